@@ -0,0 +1,65 @@
+"""Time the search backends side by side on the configured corpus.
+
+The Mongo search fields, token Bloom filter and (for SEARCH_MODE=memory)
+title index are prepared as at bot startup, so the index-backed modes are
+timed rather than their regex fallback. The SQLite backend is filled from
+Mongo first (at ``--sqlite-path``, kept between runs), then every
+canonical query runs on each backend directly, bypassing the result page
+cache.
+
+    python -m benchmarks.search_backends "dune 2021" "avatar" "spider man"
+"""
+
+import argparse
+import asyncio
+import time
+
+from bot.config import settings
+from database.canonical import canonical_query
+from database.ia_filterdb import (
+    MongoBackend,
+    SqliteBackend,
+    backfill_search_fields,
+    load_memory_index,
+    rebuild_token_bloom,
+)
+
+
+async def run(queries, rounds: int, sqlite_path: str) -> None:
+    start = time.perf_counter()
+    updated = await backfill_search_fields()
+    await rebuild_token_bloom()
+    await load_memory_index()
+    print(f"mongo setup: {updated} files backfilled in {time.perf_counter() - start:.1f} s")
+
+    sqlite = SqliteBackend(sqlite_path)
+    await sqlite.open()
+    start = time.perf_counter()
+    added = await sqlite.sync()
+    print(f"sqlite sync: {added} files copied in {time.perf_counter() - start:.1f} s")
+
+    backends = [MongoBackend(), sqlite]
+    mode = settings.SEARCH_MODE.lower()
+    for query in queries:
+        for backend in backends:
+            args = (canonical_query(query), None, 10, 0, mode, False, False, False, settings.SEARCH_SORT)
+            files, _, total = await backend.search(*args)  # warm up
+            start = time.perf_counter()
+            for _ in range(rounds):
+                await backend.search(*args)
+            elapsed = (time.perf_counter() - start) / rounds
+            print(f"{query!r:>24} {backend.name:>7}: {elapsed * 1e3:8.2f} ms  "
+                  f"({len(files)} shown, {total} total)")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("queries", nargs="+")
+    parser.add_argument("--rounds", type=int, default=20)
+    parser.add_argument("--sqlite-path", default=settings.SQLITE_INDEX_PATH)
+    args = parser.parse_args()
+    asyncio.run(run(args.queries, args.rounds, args.sqlite_path))
+
+
+if __name__ == "__main__":
+    main()
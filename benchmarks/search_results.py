@@ -0,0 +1,106 @@
+"""Compare umongo ``Media`` hydration with projected ``SearchResult`` rows.
+
+Offline it times building result objects from synthetic documents, which
+is the per-row CPU cost of a search page. With ``--query`` it also runs
+the search filter against the configured database both ways.
+
+    python -m benchmarks.search_results
+    python -m benchmarks.search_results --query "dune 2021" --rounds 50
+"""
+
+import argparse
+import asyncio
+import time
+
+from database.ia_filterdb import (
+    RESULT_FIELDS,
+    Media,
+    SearchResult,
+    _search_fields,
+    tokenize,
+)
+
+CAPTION = "<b>Dune Part Two (2024)</b> 1080p WEB-DL x264 " * 20
+
+
+def _documents(n: int) -> list:
+    docs = []
+    for i in range(n):
+        name = f"Dune.Part.Two.2024.{(720, 1080, 2160)[i % 3]}p.WEB-DL.{i}.mkv"
+        docs.append({
+            "_id": f"BQACAgUAAxkBAAI{i:010d}",
+            "file_ref": None,
+            "file_name": name,
+            "file_size": 1_500_000_000 + i,
+            "file_type": "document",
+            "mime_type": "video/x-matroska",
+            "caption": CAPTION,
+            **_search_fields(name),
+        })
+    return docs
+
+
+def _render(files) -> int:
+    # What auto_filter reads from every row.
+    return sum(len(f.file_name) + f.file_size + len(f.file_id) for f in files)
+
+
+def _timed(fn, rounds: int) -> float:
+    start = time.perf_counter()
+    for _ in range(rounds):
+        fn()
+    return (time.perf_counter() - start) / rounds
+
+
+def bench_build(rows: int, rounds: int) -> None:
+    docs = _documents(rows)
+    projected = [
+        {"_id": d["_id"], **{k: d[k] for k in RESULT_FIELDS}} for d in docs
+    ]
+
+    full = _timed(lambda: _render([Media.build_from_mongo(d) for d in docs]), rounds)
+    lean = _timed(lambda: _render([SearchResult(d) for d in projected]), rounds)
+
+    print(f"build {rows} rows: Media {full * 1e6:9.1f} us   "
+          f"SearchResult {lean * 1e6:9.1f} us   ({full / lean:.1f}x)")
+
+
+async def bench_query(query: str, rows: int, rounds: int) -> None:
+    mongo_filter = {"tokens": {"$all": tokenize(query)}}
+
+    async def full():
+        files = await Media.find(mongo_filter).sort("_id", -1).limit(rows).to_list(rows)
+        return _render(files)
+
+    async def lean():
+        cursor = (
+            Media.collection.find(mongo_filter, RESULT_FIELDS)
+            .sort("_id", -1)
+            .limit(rows)
+        )
+        return _render([SearchResult(doc) async for doc in cursor])
+
+    for label, fn in (("Media.find", full), ("projected", lean)):
+        await fn()  # warm up the connection and the plan cache
+        start = time.perf_counter()
+        for _ in range(rounds):
+            await fn()
+        elapsed = (time.perf_counter() - start) / rounds
+        print(f"query {query!r} ({rows} rows) {label:>10}: {elapsed * 1e3:8.2f} ms")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=10)
+    parser.add_argument("--rounds", type=int, default=2000)
+    parser.add_argument("--query", help="also time this search against the database")
+    args = parser.parse_args()
+
+    bench_build(args.rows, args.rounds)
+    bench_build(args.rows * 10, max(1, args.rounds // 10))
+    if args.query:
+        asyncio.run(bench_query(args.query, args.rows, min(args.rounds, 100)))
+
+
+if __name__ == "__main__":
+    main()
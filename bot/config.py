@@ -5,6 +5,9 @@ from pydantic import field_validator
 
 TRUE_VALUES = {"true", "yes", "1", "enable", "y"}
 FALSE_VALUES = {"false", "no", "0", "disable", "n"}
+READ_PREFERENCE_MODES = (
+    "primary", "primarypreferred", "secondary", "secondarypreferred", "nearest",
+)
 
 
 def parse_bool(value: str | bool, default: bool) -> bool:
@@ -31,6 +34,69 @@ class Settings(BaseSettings):
     # ─── Bot settings ──────────────────────────────────────────────────
     CACHE_TIME: int = 300
     USE_CAPTION_FILTER: bool = False
+    # "regex" scans file names (and captions with USE_CAPTION_FILTER);
+    # "tokens" intersects whole words through the indexed token array;
+    # "text" uses the file_name/caption text index ranked by textScore;
+    # "trigram" ranks names by shared character trigrams (typo tolerant);
+    # "ranked" orders token matches by name length and title boosts;
+    # "memory" answers from an in-process NumPy index (needs numpy).
+    # Only "regex" and "text" see captions: with USE_CAPTION_FILTER the
+    # other modes search in "regex" mode instead.
+    SEARCH_MODE: str = "tokens"
+    # Result counts stop at this many matches and are shown as "N+";
+    # 0 counts every match.
+    SEARCH_COUNT_LIMIT: int = 100
+    # Order of token and regex search results: newest, largest, smallest,
+    # or empty for file id order
+    SEARCH_SORT: str = "newest"
+    # In-process cache of result pages; SEARCH_CACHE_SIZE=0 disables it.
+    SEARCH_CACHE_SIZE: int = 2048
+    SEARCH_CACHE_TTL: int = 600
+    # Bloom filter of indexed tokens used to skip searches that cannot match
+    # (token mode only).
+    SEARCH_BLOOM: bool = True
+    SEARCH_BLOOM_ERROR_RATE: float = 0.01
+    # Share of query trigrams a file name must contain to match in trigram
+    # mode; with SEARCH_TRIGRAM_FALLBACK empty searches that the Bloom
+    # filter did not rule out retry that way before spell check. Trigrams
+    # are only stored and indexed while one of the two is on; switching
+    # adds or removes them for every file at the next start.
+    SEARCH_TRIGRAM_THRESHOLD: float = 0.6
+    SEARCH_TRIGRAM_FALLBACK: bool = False
+    # Most recently indexed token matches scored per query in ranked mode.
+    SEARCH_RANK_CANDIDATES: int = 500
+    # First result pages of this many most frequent searches stay
+    # precomputed and are refreshed after indexing (0 disables)
+    SEARCH_HOT_QUERIES: int = 50
+    # Deadlines for the Mongo work of one search (0 disables); searches that
+    # hit them return the matches found so far
+    SEARCH_TIMEOUT_MS: int = 3000
+    INLINE_SEARCH_TIMEOUT_MS: int = 1500
+    # Searches slower than this are explained and reported by /slowqueries
+    # (0 disables the profiler)
+    SLOW_QUERY_MS: int = 0
+    # Where search reads go in a replica set: primary, primaryPreferred,
+    # secondary, secondaryPreferred or nearest. Secondaries at most
+    # SEARCH_MAX_STALENESS_S behind are used (0 for no limit, else >= 90);
+    # hedged reads need MongoDB 4.4 to 7.x and a non-primary mode, and are
+    # deprecated: MongoDB 8.0 ignores them and PyMongo warns when they are set.
+    SEARCH_READ_PREFERENCE: str = "primary"
+    SEARCH_MAX_STALENESS_S: int = 0
+    SEARCH_HEDGED_READS: bool = False
+    # Snapshot file of the in-memory index; processes on one host map the
+    # same file instead of each loading the collection.
+    SEARCH_INDEX_PATH: Optional[str] = None
+    # "mongo" runs SEARCH_MODE queries; "sqlite" answers searches from a
+    # local FTS5 index at SQLITE_INDEX_PATH kept in sync by save_file
+    SEARCH_BACKEND: str = "mongo"
+    SQLITE_INDEX_PATH: str = "data/search.db"
+    # Collapse versions of one title into a single result button
+    GROUP_RESULTS: bool = False
+    # Filter buttons for the file types, qualities and years of results
+    SEARCH_FACETS: bool = True
+    # Seconds the next result page, fetched in the background after a page
+    # is sent, is kept for the NEXT button (0 disables prefetching)
+    PREFETCH_TTL: int = 120
     PICS: List[str] = [
         "https://github.com/OpheliaBhuletova/Flixy-Search-Bot/blob/main/static/images/startup_image.jpg"
     ]
@@ -54,6 +120,10 @@ class Settings(BaseSettings):
     DATABASE_URL: str
     DATABASE_NAME: str = "Telegram"
     COLLECTION_NAME: str = "channel_files"
+    # Extra MongoDB URLs holding more indexed files (same database and
+    # collection names). Searches cover all of them; new files, users and
+    # settings are stored in DATABASE_URL.
+    MEDIA_DATABASE_URLS: List[str] = []
 
     # ─── Others ────────────────────────────────────────────────────────
     LOG_CHANNEL: int = 0
@@ -94,6 +164,11 @@ class Settings(BaseSettings):
         "MELCOW_NEW_USERS",
         "PROTECT_CONTENT",
         "PUBLIC_FILE_STORE",
+        "SEARCH_BLOOM",
+        "SEARCH_TRIGRAM_FALLBACK",
+        "GROUP_RESULTS",
+        "SEARCH_FACETS",
+        "SEARCH_HEDGED_READS",
         mode="before",
     )
     @classmethod
@@ -107,9 +182,30 @@ class Settings(BaseSettings):
             "MELCOW_NEW_USERS": False,
             "PROTECT_CONTENT": False,
             "PUBLIC_FILE_STORE": True,
+            "SEARCH_BLOOM": True,
+            "SEARCH_TRIGRAM_FALLBACK": False,
+            "GROUP_RESULTS": False,
+            "SEARCH_FACETS": True,
+            "SEARCH_HEDGED_READS": False,
         }
         return parse_bool(v, defaults[info.field_name])
 
+    @field_validator("SEARCH_READ_PREFERENCE")
+    @classmethod
+    def validate_read_preference(cls, v):
+        if v.lower() not in READ_PREFERENCE_MODES:
+            raise ValueError(f"SEARCH_READ_PREFERENCE must be one of {', '.join(READ_PREFERENCE_MODES)}")
+        return v
+
+    @field_validator("SEARCH_MAX_STALENESS_S")
+    @classmethod
+    def validate_max_staleness(cls, v):
+        # MongoDB refuses limits under 90 s only at server selection,
+        # which would fail every search.
+        if v != 0 and v < 90:
+            raise ValueError("SEARCH_MAX_STALENESS_S must be 0 (no limit) or at least 90")
+        return v
+
     class Config:
         env_file = ".env"
         case_sensitive = True
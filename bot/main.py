@@ -15,7 +15,15 @@ from bot.config import LOG_STR, settings
 from bot.utils.cache import RuntimeCache
 from bot.utils.helpers import schedule_delete_message
 from pyrogram.types import InlineKeyboardButton, InlineKeyboardMarkup
-from database.ia_filterdb import Media
+from database.ia_filterdb import (
+    Media,
+    backfill_search_fields,
+    drop_retired_indexes,
+    ensure_shard_indexes,
+    load_memory_index,
+    load_search_backend,
+    rebuild_token_bloom,
+)
 from database.users_chats_db import get_db_instance
 from plugins import web_server
 
@@ -106,6 +114,28 @@ async def get_chat_info(app: Client, chat_id: int) -> dict | None:
     return await botapi_get_chat(app.bot_token, chat_id)
 
 
+async def _run_search_backfill():
+    try:
+        await backfill_search_fields()
+    except Exception:
+        logger.exception("Failed to backfill media search fields")
+
+    try:
+        await rebuild_token_bloom()
+    except Exception:
+        logger.exception("Failed to build token bloom filter")
+
+    try:
+        await load_memory_index()
+    except Exception:
+        logger.exception("Failed to load in-memory title index")
+
+    try:
+        await load_search_backend()
+    except Exception:
+        logger.exception("Failed to load search backend")
+
+
 class Bot(Client):
     def __init__(self):
         super().__init__(
@@ -175,6 +205,20 @@ class Bot(Client):
             else:
                 raise
 
+        try:
+            await ensure_shard_indexes()
+        except Exception:
+            logger.exception("failed to create indexes in extra media databases")
+
+        try:
+            await drop_retired_indexes()
+        except Exception:
+            logger.exception("failed to drop retired media indexes")
+
+        # Compute token fields for files indexed by older versions and load
+        # the token bloom filter
+        asyncio.create_task(_run_search_backfill())
+
         # Bot identity
         me = await self.get_me()
         RuntimeCache.bot_username = me.username
@@ -1,3 +1,4 @@
+import asyncio
 import re
 from datetime import datetime
 from typing import Any, Dict, List, Optional
@@ -5,8 +6,11 @@ from typing import Any, Dict, List, Optional
 from imdb import IMDb
 
 from bot.config import settings
+from bot.utils.singleflight import SingleFlight
+from database.canonical import split_year
 
 imdb = IMDb()
+_poster_flight = SingleFlight()
 
 GENRE_EMOJI = {
     "Action": "🔫",
@@ -113,19 +117,27 @@ def _parse_release_info(release_str: Optional[str]) -> Dict[str, str]:
 async def get_poster(
     query: str, *, bulk: bool = False, imdb_id: bool = False, id: bool = False, file=None
 ):
+    """Look up IMDb details for a query or id.
+
+    IMDbPY blocks, so the lookup runs in a worker thread; concurrent calls
+    for the same query share a single lookup.
+    """
     if id:
         imdb_id = True
+    key = (query.lower().strip(), bool(imdb_id))
+    return await _poster_flight.do(key, asyncio.to_thread, _fetch_poster, query, imdb_id)
+
+
+def _fetch_poster(query: str, imdb_id: bool):
     if not imdb_id:
-        query = query.lower().strip()
-        year = re.findall(r"[1-2]\d{3}", query)
-        title = query.replace(year[0], "").strip() if year else query
+        title, year = split_year(query)
 
         results = imdb.search_movie(title, results=10)
         if not results:
             return None
 
         if year:
-            results = [r for r in results if str(r.get("year")) == year[0]]
+            results = [r for r in results if r.get("year") == year]
 
         movie = results[0]
         imdb_id = movie.movieID
@@ -168,16 +180,14 @@ async def get_imdb_info(query: str, *, imdb_id: bool = False, id: bool = False)
     if id:
         imdb_id = True
     if not imdb_id:
-        query = query.lower().strip()
-        year = re.findall(r"[1-2]\d{3}", query)
-        title = query.replace(year[0], "").strip() if year else query
+        title, year = split_year(query)
 
         results = imdb.search_movie(title, results=10)
         if not results:
             return None
 
         if year:
-            results = [r for r in results if str(r.get("year")) == year[0]]
+            results = [r for r in results if r.get("year") == year]
 
         movie = results[0]
         imdb_id = movie.movieID
@@ -1,5 +1,7 @@
 import os
-from typing import Dict, Any
+import time
+from collections import OrderedDict
+from typing import Dict, Any, Hashable
 
 
 class RuntimeCache:
@@ -17,4 +19,48 @@ class RuntimeCache:
     bot_name: str | None = None
     startup_time: Any = None
     index_skip: int = 0
-    ad_enabled: bool = False
\ No newline at end of file
+    ad_enabled: bool = False
+
+
+class TTLCache:
+    """Bounded in-memory LRU mapping whose entries expire after ``ttl`` seconds."""
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 300.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: "OrderedDict[Hashable, tuple[float, Any]]" = OrderedDict()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        item = self._data.get(key)
+        if item is None:
+            return default
+
+        expires, value = item
+        if expires < time.monotonic():
+            del self._data[key]
+            return default
+
+        self._data.move_to_end(key)
+        return value
+
+    def set(self, key: Hashable, value: Any) -> None:
+        self._data[key] = (time.monotonic() + self.ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        item = self._data.pop(key, None)
+        return default if item is None else item[1]
+
+    def clear(self) -> None:
+        self._data.clear()
+
+    def __contains__(self, key: Hashable) -> bool:
+        return self.get(key, _MISSING) is not _MISSING
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+_MISSING = object()
@@ -201,6 +201,12 @@ Restricted commands for bot administrators.
 • `/broadcast` — broadcast a message
 """
 
+    # ───────────────────────────────────
+    # SEARCH
+    # ───────────────────────────────────
+
+    PARTIAL_RESULTS_TXT = "⏱ Search took too long, showing partial results. Try a more specific query."
+
     # ───────────────────────────────────
     # STATUS / LOGS
     # ───────────────────────────────────
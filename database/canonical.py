@@ -0,0 +1,83 @@
+"""Canonical forms of file names and search queries.
+
+File names at ingest and queries at search time are folded the same way,
+so stored tokens, page cache keys and what users type line up: text is
+case-folded, accents are stripped and every run of punctuation becomes a
+single space. Queries also lose the chat words users wrap around a title
+("send dune movie pls" is searched as "dune").
+
+Folding is memoized in bounded LRU caches; the same names and queries
+come back constantly.
+"""
+
+import re
+import unicodedata
+from functools import lru_cache
+from typing import List, Optional, Tuple
+
+CACHE_SIZE = 16384
+
+TOKEN_SPLIT = re.compile(r"[\W_]+")
+# Separators in uploaded file names, shown as spaces ("Dune.2021.1080p.mkv").
+NAME_SEPARATORS = re.compile(r"[_\-\.\+]")
+YEAR = re.compile(r"(?:19[2-9]\d|20[0-4]\d)")
+
+# Words asked for around a title; only stripped from the ends of a query,
+# so titles such as "Scary Movie 3" keep theirs.
+FILLER_WORDS = frozenset({
+    "movie", "movies", "film", "file", "files", "send", "pls", "plz", "please",
+})
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def fold(text: str) -> str:
+    """Case-folded ``text`` without accents, words separated by single spaces."""
+    text = unicodedata.normalize("NFKD", text.casefold())
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    return " ".join(t for t in TOKEN_SPLIT.split(text) if t)
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def _tokens(text: str) -> Tuple[str, ...]:
+    return tuple(dict.fromkeys(fold(text).split()))
+
+
+def tokenize(text: str) -> List[str]:
+    """Split text into unique canonical word tokens, keeping their order."""
+    if not text:
+        return []
+    return list(_tokens(text))
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def canonical_query(query: str) -> str:
+    """Folded ``query`` without leading or trailing filler words.
+
+    A query made only of filler words is kept as is, so "movie" still
+    searches for "movie".
+    """
+    words = fold(query).split()
+    start, end = 0, len(words)
+    while start < end and words[start] in FILLER_WORDS:
+        start += 1
+    while end > start and words[end - 1] in FILLER_WORDS:
+        end -= 1
+    return " ".join(words[start:end] or words)
+
+
+def split_year(text: str) -> Tuple[str, Optional[int]]:
+    """Split a release year off a title: "Dune (2021)" -> ("dune", 2021).
+
+    A year is only taken once some title word precedes it, so "2012" on
+    its own stays a title.
+    """
+    words = canonical_query(text).split()
+    for i in range(1, len(words)):
+        if YEAR.fullmatch(words[i]):
+            return " ".join(words[:i] + words[i + 1:]), int(words[i])
+    return " ".join(words), None
+
+
+def display_name(file_name) -> str:
+    """File name as stored and shown, with separators turned into spaces."""
+    return NAME_SEPARATORS.sub(" ", str(file_name))
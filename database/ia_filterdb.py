@@ -1,26 +1,68 @@
+import abc
+import asyncio
+import heapq
+import itertools
+import json
 import logging
+import math
+import os
 import re
 import base64
+import time
+from collections import Counter
+from contextvars import ContextVar
+from datetime import datetime, timedelta, timezone
 from struct import pack
-from typing import Tuple, List
+from typing import Tuple, List, Optional, Union
 
 from pyrogram.file_id import FileId
-from pymongo.errors import DuplicateKeyError
+from pymongo import UpdateOne
+from pymongo.errors import DuplicateKeyError, ExecutionTimeout
 from marshmallow.exceptions import ValidationError
 
 from umongo import Instance, Document, fields
 from motor.motor_asyncio import AsyncIOMotorClient
 
 from bot.config import settings
+from bot.utils.bloom import BloomFilter
+from bot.utils.cache import TTLCache
+from bot.utils.singleflight import SingleFlight
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.WARNING)
 
-from database.mongo import get_db
+from database.mongo import get_db, get_media_shards, get_search_read_preference
+from database import media_tags, memory_index, ranking, sqlite_index
+from database.canonical import canonical_query, display_name, tokenize
 from umongo import Instance
 
 instance = Instance.from_db(get_db())
 
+# Bump whenever the fields produced by ``_search_fields`` change so that
+# ``backfill_search_fields`` recomputes them for already indexed files.
+SEARCH_SCHEMA_VERSION = 6
+
+# Trigrams take several times the space of the other search fields, so
+# they are only stored and indexed while a search uses them.
+TRIGRAMS_ENABLED = (
+    settings.SEARCH_MODE.lower() == "trigram" or settings.SEARCH_TRIGRAM_FALLBACK
+)
+# Stored in ``search_v``: the schema version, with the low bit telling
+# whether the file's fields include trigrams.
+SEARCH_FIELDS_VERSION = SEARCH_SCHEMA_VERSION * 2 + TRIGRAMS_ENABLED
+
+
+# Set once every stored document carries the current search fields; until
+# then index-backed search modes fall back to the regex scan.
+_search_fields_ready = False
+INDEXED_MODES = {"tokens", "trigram", "ranked"}
+# Modes that only see the canonical words of a query (see ``_query_key``).
+FOLDED_MODES = {"tokens", "trigram", "ranked", "memory"}
+
+# Partial words shorter than this are ignored by prefix searches; a single
+# letter would match a large share of the tokens index.
+PREFIX_MIN_LENGTH = 2
+
 
 # ─── Media Document ──────────────────────────────────────────────────────
 @instance.register
@@ -32,6 +74,20 @@ class Media(Document):
     file_type = fields.StrField(allow_none=True)
     mime_type = fields.StrField(allow_none=True)
     caption = fields.StrField(allow_none=True)
+    tokens = fields.ListField(fields.StrField(), allow_none=True)
+    trigrams = fields.ListField(fields.StrField(), allow_none=True)
+    year = fields.IntField(allow_none=True)
+    years = fields.ListField(fields.IntField(), allow_none=True)
+    season = fields.IntField(allow_none=True)
+    episode = fields.IntField(allow_none=True)
+    quality = fields.StrField(allow_none=True)
+    languages = fields.ListField(fields.StrField(), allow_none=True)
+    group_key = fields.StrField(allow_none=True)
+    search_v = fields.IntField(allow_none=True)
+    # When the bot stored the file, and the date of the message it came
+    # from; files saved by older versions have neither.
+    indexed_at = fields.DateTimeField(allow_none=True)
+    message_date = fields.DateTimeField(allow_none=True)
 
     class Meta:
         collection_name = settings.COLLECTION_NAME
@@ -42,8 +98,175 @@ class Media(Document):
         # records but that's fine for search.
         indexes = [
             {"key": [("file_name", "text"), ("caption", "text")]},
-            "file_type",
+            *(["trigrams"] if TRIGRAMS_ENABLED else []),
+            "years",
+            "quality",
+            "languages",
+            {"key": [("season", 1), ("episode", 1)]},
+            {"key": [("group_key", 1), ("file_size", -1)]},
+            "search_v",
+            # SORT_MODES orders, with or without a file type or token filter;
+            # they also serve plain file_type and tokens lookups.
+            {"key": [("file_type", 1), ("indexed_at", -1), ("_id", -1)]},
+            {"key": [("file_type", 1), ("file_size", -1), ("_id", -1)]},
+            {"key": [("tokens", 1), ("indexed_at", -1), ("_id", -1)]},
+            {"key": [("tokens", 1), ("file_size", -1), ("_id", -1)]},
+            {"key": [("indexed_at", -1), ("_id", -1)]},
+            {"key": [("file_size", -1), ("_id", -1)]},
+        ]
+
+
+# ─── Media Databases ─────────────────────────────────────────────────────
+# Files live in the primary DATABASE_URL plus any MEDIA_DATABASE_URLS.
+# New files are written to the primary; reads fan out to all of them.
+# Searches read with SEARCH_READ_PREFERENCE so replica set secondaries can
+# serve them; ingest and startup scans stay on the replica set primary.
+_search_colls: Optional[list] = None
+
+
+def _collections() -> list:
+    return [Media.collection, *get_media_shards()]
+
+
+def _search_collections() -> list:
+    """``_collections`` with the search read preference applied."""
+    global _search_colls
+
+    if _search_colls is None:
+        preference = get_search_read_preference()
+        _search_colls = [
+            coll.with_options(read_preference=preference) for coll in _collections()
+        ]
+    return _search_colls
+
+
+async def _fan_out(fn) -> list:
+    """Run ``fn(collection)`` on every media collection concurrently."""
+    return await asyncio.gather(*(fn(coll) for coll in _search_collections()))
+
+
+async def _merged_rows(fetch, skip: int, limit: int, key, reverse: bool = True) -> list:
+    """Rows ``skip:skip + limit`` of the union of every collection's results.
+
+    ``fetch(coll, skip, limit)`` returns one collection's rows sorted by
+    ``key``, descending unless ``reverse`` is false. With several
+    collections each returns its first ``skip + limit`` rows and they are
+    merged here; a file stored in more than one database is listed once.
+    """
+    colls = _search_collections()
+    if len(colls) == 1:
+        return await fetch(colls[0], skip, limit)
+
+    parts = await asyncio.gather(*(fetch(coll, 0, skip + limit) for coll in colls))
+    merged = heapq.merge(*parts, key=key, reverse=reverse)
+    return list(itertools.islice(_unique(merged), skip, skip + limit))
+
+
+def _unique(rows):
+    seen = set()
+    for row in rows:
+        if row["_id"] not in seen:
+            seen.add(row["_id"])
+            yield row
+
+
+# Indexes created by older versions that are no longer used: file_type and
+# tokens are prefixes of the sort indexes, and years replaced year.
+RETIRED_INDEXES = ("file_type_1", "tokens_1", "year_1")
+
+
+async def ensure_shard_indexes() -> None:
+    """Create the ``Media`` indexes in the extra media databases."""
+    for coll in get_media_shards():
+        await coll.create_indexes(Media.indexes)
+
+
+async def drop_retired_indexes() -> None:
+    """Drop ``RETIRED_INDEXES`` from every media database (startup).
+
+    The trigrams index goes too while trigram search is off.
+    """
+    retired = RETIRED_INDEXES if TRIGRAMS_ENABLED else RETIRED_INDEXES + ("trigrams_1",)
+    for coll in _collections():
+        existing = await coll.index_information()
+        for name in retired:
+            if name in existing:
+                await coll.drop_index(name)
+                logger.info("Dropped retired index %s", name)
+
+
+async def count_files() -> int:
+    """Number of indexed files across all media databases."""
+    return sum(await _fan_out(lambda coll: coll.count_documents({})))
+
+
+# ─── Search Fields ───────────────────────────────────────────────────────
+def trigrams(text: str) -> List[str]:
+    """Unique padded character trigrams of every token in ``text``.
+
+    Tokens are padded like ``"  word "`` so word starts weigh more than
+    word ends, which suits partially typed titles.
+    """
+    grams = {}
+    for token in tokenize(text):
+        padded = f"  {token} "
+        for i in range(len(padded) - 2):
+            grams[padded[i:i + 3]] = None
+    return list(grams)
+
+
+def _search_fields(file_name: str) -> dict:
+    """Derived fields stored next to ``file_name`` for index-backed search."""
+    tokens = tokenize(file_name)
+    fields = {
+        "tokens": tokens,
+        **media_tags.media_tag_fields(tokens),
+        "group_key": media_tags.group_key(tokens),
+        "search_v": SEARCH_FIELDS_VERSION,
+    }
+    if TRIGRAMS_ENABLED:
+        fields["trigrams"] = trigrams(file_name)
+    return fields
+
+
+async def backfill_search_fields(batch_size: int = 500) -> int:
+    """Compute search fields for files saved by older versions of the bot.
+
+    Runs once at startup; index-backed search modes are enabled when it
+    finishes. Returns the number of updated documents.
+    """
+    global _search_fields_ready
+
+    base = SEARCH_SCHEMA_VERSION * 2
+    stale = {
+        "$or": [
+            {"search_v": {"$not": {"$gte": base}}},
+            # Saved while trigram search was switched the other way.
+            {"search_v": base + (not TRIGRAMS_ENABLED)},
         ]
+    }
+    updated = 0
+
+    for coll in _collections():
+        ops = []
+        async for doc in coll.find(stale, {"file_name": 1}):
+            update = {"$set": _search_fields(doc.get("file_name") or "")}
+            if not TRIGRAMS_ENABLED:
+                update["$unset"] = {"trigrams": ""}
+            ops.append(UpdateOne({"_id": doc["_id"]}, update))
+            if len(ops) >= batch_size:
+                await coll.bulk_write(ops, ordered=False)
+                updated += len(ops)
+                ops = []
+
+        if ops:
+            await coll.bulk_write(ops, ordered=False)
+            updated += len(ops)
+
+    _search_fields_ready = True
+    if updated:
+        logger.warning("Backfilled search fields for %s files", updated)
+    return updated
 
 
 # ─── Save Media ──────────────────────────────────────────────────────────
@@ -58,7 +281,9 @@ async def save_file(media) -> Tuple[bool, int, str]:
     """
 
     file_id, file_ref = unpack_new_file_id(media.file_id)
-    file_name = re.sub(r"[_\-\.\+]", " ", str(media.file_name))
+    file_name = display_name(media.file_name)
+    # Set by callers from the source message; Pyrogram dates are local time.
+    message_date = getattr(media, "message_date", None)
 
     try:
         file = Media(
@@ -69,13 +294,22 @@ async def save_file(media) -> Tuple[bool, int, str]:
             file_type=media.file_type,
             mime_type=media.mime_type,
             caption=media.caption.html if media.caption else None,
+            indexed_at=datetime.now(timezone.utc),
+            message_date=message_date.astimezone(timezone.utc) if message_date else None,
+            **_search_fields(file_name),
         )
     except ValidationError:
         logger.exception("Validation error while saving media")
-        return False, 2
+        return False, 2, file_name
 
     try:
+        if await _in_other_database(file_id):
+            return False, 0, file_name
         await file.commit()
+        _bump_generation()
+        _remember_tokens(file.tokens or [])
+        _index_in_memory(file)
+        await _feed_backends(file.to_mongo())
         return True, 1, file_name
 
     except DuplicateKeyError:
@@ -86,56 +320,1662 @@ async def save_file(media) -> Tuple[bool, int, str]:
         return False, 2, file_name
 
 
+async def _in_other_database(file_id: str) -> bool:
+    """Whether an extra media database already holds ``file_id``."""
+    shards = get_media_shards()
+    if not shards:
+        return False
+    found = await asyncio.gather(
+        *(coll.find_one({"_id": file_id}, {"_id": 1}) for coll in shards)
+    )
+    return any(found)
+
+
+# ─── Token Bloom Filter ──────────────────────────────────────────────────
+# Every token of every indexed file name. A query token missing from the
+# filter cannot match anything, so such searches skip Mongo entirely.
+_token_bloom: Optional[BloomFilter] = None
+_bloom_building: Optional[BloomFilter] = None
+
+
+async def rebuild_token_bloom() -> None:
+    """Load all file name tokens into a fresh Bloom filter (startup)."""
+    global _token_bloom, _bloom_building
+
+    if not settings.SEARCH_BLOOM:
+        return
+
+    docs = sum(await _fan_out(lambda coll: coll.estimated_document_count()))
+    bloom = BloomFilter(max(100_000, docs * 4), settings.SEARCH_BLOOM_ERROR_RATE)
+    # Files saved while the scan runs are added by save_file as well.
+    _bloom_building = bloom
+    try:
+        async for doc in _scan_all({"file_name": 1}):
+            bloom.update(tokenize(doc.get("file_name") or ""))
+    finally:
+        _bloom_building = None
+
+    _token_bloom = bloom
+    logger.info("Token bloom filter ready with %s tokens", bloom.count)
+
+
+async def _scan_all(projection: dict, query: Optional[dict] = None):
+    """Every matching document of every media database, one after another."""
+    for coll in _collections():
+        async for doc in coll.find(query or {}, projection).sort("$natural", 1):
+            yield doc
+
+
+def _remember_tokens(tokens: List[str]) -> None:
+    for bloom in (_token_bloom, _bloom_building):
+        if bloom is not None:
+            bloom.update(tokens)
+
+
+def _definitely_absent(tokens: List[str]) -> bool:
+    return _token_bloom is not None and any(t not in _token_bloom for t in tokens)
+
+
+def rejected_by_bloom(query: str) -> bool:
+    """Whether the Bloom filter rules out every token match of ``query``.
+
+    Such queries are mostly chat messages, so callers skip fuzzy retries.
+    """
+    tokens = tokenize(canonical_query(query))
+    if _search_fields_ready:
+        _, tokens = media_tags.parse_query(tokens)
+    return _definitely_absent(tokens)
+
+
+# ─── In-Memory Engine ────────────────────────────────────────────────────
+# Loaded at startup when SEARCH_MODE=memory; searches use token mode until
+# it is ready.
+_memory: Optional["memory_index.TitleIndex"] = None
+_memory_pending: Optional[list] = None
+# Seconds between checks for a snapshot rewritten by another process.
+MEMORY_SNAPSHOT_CHECK_INTERVAL = 60
+_memory_watch: Optional[asyncio.Task] = None
+
+
+MEMORY_FIELDS = {"file_name": 1, "file_size": 1, "file_type": 1, "tokens": 1}
+
+
+async def load_memory_index() -> None:
+    """Load the NumPy title index (startup).
+
+    With ``SEARCH_INDEX_PATH`` set, an existing snapshot is memory-mapped
+    and only files missing from it are read from Mongo. Without one, or
+    when it was built under another ``SEARCH_SCHEMA_VERSION`` and holds
+    stale tokens, every file name is loaded and, if a path is configured,
+    written out as the snapshot for the next start and for other
+    processes on the host.
+    The snapshot is then reopened whenever another process rewrites it.
+    """
+    global _memory, _memory_pending, _memory_watch
+
+    if settings.SEARCH_MODE.lower() != "memory":
+        return
+    if memory_index.np is None:
+        logger.warning("SEARCH_MODE=memory needs numpy; using token search")
+        return
+
+    path = settings.SEARCH_INDEX_PATH
+    # Files saved while loading are replayed afterwards.
+    _memory_pending = []
+    try:
+        index = None
+        if path and os.path.exists(path):
+            try:
+                index = await asyncio.to_thread(
+                    memory_index.TitleIndex.open, path, SEARCH_SCHEMA_VERSION
+                )
+                await _catch_up_memory_index(index)
+            except Exception:
+                logger.exception("Could not use title index snapshot %s; rebuilding", path)
+                index = None
+
+        if index is None:
+            index = await memory_index.TitleIndex.from_documents(
+                _scan_all(MEMORY_FIELDS), tokenize, SEARCH_SCHEMA_VERSION
+            )
+            if path:
+                await index.persist(path)
+
+        pending = {doc.file_id: doc for doc in _memory_pending}
+        for file_id in index.missing(list(pending)):
+            _add_to_memory(index, pending[file_id])
+    finally:
+        _memory_pending = None
+
+    _memory = index
+    logger.info("In-memory title index ready with %s files", len(index))
+
+    if path and _memory_watch is None:
+        _memory_watch = asyncio.create_task(_watch_memory_snapshot())
+
+
+async def _watch_memory_snapshot() -> None:
+    """Pick up snapshots that other processes on the host compacted into."""
+    while True:
+        await asyncio.sleep(MEMORY_SNAPSHOT_CHECK_INTERVAL)
+        try:
+            if await _memory.reload():
+                logger.info("Reopened title index snapshot with %s files", len(_memory))
+        except Exception:
+            logger.exception("Failed to reopen title index snapshot")
+
+
+async def _catch_up_memory_index(index, batch_size: int = 50_000) -> None:
+    """Add files indexed in Mongo after the snapshot was written.
+
+    Only ``_id`` is read for the comparison, which Mongo serves from the
+    ``_id`` index without touching the documents.
+    """
+    added = 0
+    for coll in _collections():
+        missing: List[str] = []
+        batch: List[str] = []
+        async for doc in coll.find({}, {"_id": 1}):
+            batch.append(doc["_id"])
+            if len(batch) >= batch_size:
+                missing += index.missing(batch)
+                batch = []
+        missing += index.missing(batch)
+
+        for i in range(0, len(missing), 1000):
+            chunk = missing[i:i + 1000]
+            async for doc in coll.find({"_id": {"$in": chunk}}, MEMORY_FIELDS):
+                index.add(
+                    doc["_id"],
+                    doc.get("tokens") or tokenize(doc.get("file_name") or ""),
+                    doc.get("file_size"),
+                    doc.get("file_type"),
+                )
+        added += len(missing)
+
+    if added:
+        logger.info("Added %s files missing from the title index snapshot", added)
+        await index.compact()
+
+
+def _add_to_memory(index, file: Media) -> None:
+    index.add(file.file_id, file.tokens or [], file.file_size, file.file_type)
+
+
+def _index_in_memory(file: Media) -> None:
+    if _memory is not None:
+        _add_to_memory(_memory, file)
+    elif _memory_pending is not None:
+        _memory_pending.append(file)
+
+
+async def _memory_search(
+    tokens: List[str],
+    file_type: Optional[str],
+    max_results: int,
+    offset: Union[int, str],
+    projection: dict,
+    partial: Optional[str] = None,
+):
+    """Rank matches in process and hydrate only the requested page."""
+    skip, _ = decode_offset(offset)
+    ids, total = _memory.page(tokens, file_type, skip, max_results, partial)
+
+    files = await _hydrate(ids, projection)
+    next_offset = skip + max_results if skip + max_results < total else ""
+    return files, next_offset, total
+
+
+async def _hydrate(ids: List[str], projection: dict) -> List["SearchResult"]:
+    """Fetch files by id, in the order of ``ids``."""
+    async def fetch(coll):
+        return await coll.find({"_id": {"$in": ids}}, projection).to_list(length=len(ids))
+
+    by_id = {doc["_id"]: SearchResult(doc) for docs in await _fan_out(fetch) for doc in docs}
+    return [by_id[i] for i in ids if i in by_id]
+
+
+# ─── Search Cache ────────────────────────────────────────────────────────
+# Cache keys embed the generation, which ``save_file`` bumps on every new
+# file, so stale pages are never served and simply age out of the LRU.
+_search_generation = 0
+_result_cache = TTLCache(
+    maxsize=settings.SEARCH_CACHE_SIZE, ttl=settings.SEARCH_CACHE_TTL
+)
+SEARCH_STATS: Counter = Counter()
+# Identical searches already running against Mongo are awaited, not repeated.
+_inflight = SingleFlight()
+
+
+def _bump_generation() -> None:
+    global _search_generation
+    _search_generation += 1
+
+
+def search_cache_stats() -> dict:
+    """Snapshot of search cache counters for the admin stats command."""
+    hits = SEARCH_STATS["cache_hits"]
+    misses = SEARCH_STATS["cache_misses"]
+    return {
+        **SEARCH_STATS,
+        "hit_rate": hits / (hits + misses) if hits + misses else 0.0,
+        "cached_pages": len(_result_cache),
+        "generation": _search_generation,
+        "coalesced": _inflight.shared,
+        "hot_pages": len(_hot_pages),
+    }
+
+
+# ─── Hot Queries ─────────────────────────────────────────────────────────
+# First pages of the SEARCH_HOT_QUERIES most frequent searches are kept
+# outside the result cache: they survive new files being saved and are
+# recomputed in the background after indexing instead. A search entering
+# the top keeps the page it just computed, so hot pages fill up without
+# waiting for new files.
+HOT_REFRESH_DELAY = 10
+# Distinct first-page searches counted before the rarest are forgotten.
+HOT_QUERY_TRACKED = 10_000
+
+_query_counts: Counter = Counter()
+_hot_pages: dict = {}
+_hot_dirty = False
+_hot_refresh: Optional[asyncio.Task] = None
+
+
+def _count_query(hot_key: tuple) -> None:
+    _query_counts[hot_key] += 1
+    if len(_query_counts) > HOT_QUERY_TRACKED:
+        keep = _query_counts.most_common(HOT_QUERY_TRACKED // 2)
+        _query_counts.clear()
+        _query_counts.update(dict(keep))
+
+
+def _hot_page(key: tuple) -> Optional["SearchPage"]:
+    """Count a first-page search by its cache ``key``; its hot page if any."""
+    if not settings.SEARCH_HOT_QUERIES:
+        return None
+    # Hot pages outlive cache generations, so the generation is left out.
+    hot_key = key[1:]
+    _count_query(hot_key)
+    hot = _hot_pages.get(hot_key)
+    if hot is not None:
+        SEARCH_STATS["hot_hits"] += 1
+    return hot
+
+
+def _fill_hot_page(key: tuple, page: "SearchPage") -> None:
+    """Keep a freshly computed first page if its search is now hot."""
+    if not settings.SEARCH_HOT_QUERIES or page.partial or key[0] != _search_generation:
+        return
+    hot_key = key[1:]
+    if hot_key in _hot_pages:
+        return
+    top = {k for k, _ in _query_counts.most_common(settings.SEARCH_HOT_QUERIES)}
+    if hot_key not in top:
+        return
+    for stale in [k for k in _hot_pages if k not in top]:
+        del _hot_pages[stale]
+    _hot_pages[hot_key] = page
+
+
+def schedule_hot_refresh() -> None:
+    """Refresh the hot query pages shortly, once per burst of new files."""
+    global _hot_dirty, _hot_refresh
+
+    if not settings.SEARCH_HOT_QUERIES or not _query_counts:
+        return
+    _hot_dirty = True
+    if _hot_refresh is None or _hot_refresh.done():
+        _hot_refresh = asyncio.create_task(_hot_refresh_loop())
+
+
+async def _hot_refresh_loop() -> None:
+    global _hot_dirty
+
+    while _hot_dirty:
+        await asyncio.sleep(HOT_REFRESH_DELAY)
+        _hot_dirty = False
+        try:
+            await refresh_hot_queries()
+        except Exception:
+            logger.exception("Failed to refresh hot search queries")
+
+
+async def refresh_hot_queries() -> None:
+    """Recompute the first page of the most frequent searches."""
+    global _hot_pages
+
+    pages = {}
+    for hot_key, _ in _query_counts.most_common(settings.SEARCH_HOT_QUERIES):
+        page = await _search_hot_key(hot_key)
+        if not page.partial:
+            pages[hot_key] = page
+    _hot_pages = pages
+
+
+async def _search_hot_key(hot_key: tuple) -> "SearchPage":
+    """Run the first-page search counted under ``hot_key``."""
+    if hot_key[0] == FACETS_KEY:
+        _, mode, query, file_type, max_results, sort = hot_key
+        return await _with_deadline(
+            settings.SEARCH_TIMEOUT_MS,
+            _faceted_search,
+            query,
+            file_type,
+            max_results,
+            mode,
+            SORT_MODES.get(sort, [("_id", -1)]),
+        )
+
+    mode, query, file_type, max_results, _, group, with_caption, prefix, sort = hot_key
+    return await _timed_search(
+        settings.SEARCH_TIMEOUT_MS,
+        query,
+        file_type,
+        max_results,
+        0,
+        mode,
+        group,
+        with_caption,
+        prefix,
+        sort,
+    )
+
+
+# ─── Search Deadline ─────────────────────────────────────────────────────
+# While a deadline is set, every query carries the time left as maxTimeMS.
+# A page is read in one batch, so a database that runs out of time returns
+# no rows at all. Partial pages therefore only come from the fan-out over
+# MEDIA_DATABASE_URLS: they hold the rows of the databases that answered
+# in time. With a single database a timed-out page is empty.
+
+
+class _Deadline:
+    __slots__ = ("at", "expired")
+
+    def __init__(self, timeout_ms: int):
+        self.at = asyncio.get_running_loop().time() + timeout_ms / 1000
+        self.expired = False
+
+
+_deadline: ContextVar[Optional[_Deadline]] = ContextVar("search_deadline", default=None)
+
+
+def _time_left_ms() -> Optional[int]:
+    """Milliseconds left for the running search; None without a deadline."""
+    deadline = _deadline.get()
+    if deadline is None:
+        return None
+    return max(1, int((deadline.at - asyncio.get_running_loop().time()) * 1000))
+
+
+def _mark_timed_out() -> None:
+    deadline = _deadline.get()
+    if deadline is not None:
+        deadline.expired = True
+
+
+def _find(coll, mongo_filter: dict, projection: dict):
+    """``coll.find`` bounded by the search deadline."""
+    cursor = coll.find(mongo_filter, projection)
+    left = _time_left_ms()
+    if left is not None:
+        cursor = cursor.max_time_ms(left)
+    return cursor
+
+
+def _aggregate(coll, pipeline: list):
+    """``coll.aggregate`` bounded by the search deadline."""
+    kwargs = {"allowDiskUse": True}
+    left = _time_left_ms()
+    if left is not None:
+        kwargs["maxTimeMS"] = left
+    return coll.aggregate(pipeline, **kwargs)
+
+
+async def _read(cursor, limit: int) -> list:
+    """Up to ``limit`` documents; none when the deadline hit."""
+    try:
+        return await cursor.to_list(length=limit)
+    except ExecutionTimeout:
+        _mark_timed_out()
+        return []
+
+
+class SearchPage(tuple):
+    """``(files, next_offset, total)``; ``partial`` when time ran out.
+
+    A partial page is not cached. It holds the matches of the media
+    databases that answered before the deadline; a database that timed
+    out contributes no rows, so with a single database it is empty. ``facets`` is set
+    by ``get_faceted_results``; ``facets_capped`` when its counts stopped
+    at ``SEARCH_COUNT_LIMIT``.
+    """
+
+    partial = False
+    facets: Optional[dict] = None
+    facets_capped = False
+
+
+# ─── Slow Query Profiler ─────────────────────────────────────────────────
+# With SLOW_QUERY_MS set, search queries slower than that are grouped by
+# shape (the filter with its values blanked out, plus the sort). Each
+# shape is explained in the background at most once per
+# SLOW_QUERY_EXPLAIN_INTERVAL seconds, against the primary media database.
+SLOW_QUERY_EXPLAIN_INTERVAL = 600
+SLOW_QUERY_SHAPES = 200
+
+_slow_queries: dict = {}
+_explain_tasks: set = set()
+
+
+class SlowQuery:
+    """Latency of one query shape and its last explained plan."""
+
+    __slots__ = (
+        "shape",
+        "count",
+        "total_ms",
+        "max_ms",
+        "plan",
+        "keys_examined",
+        "docs_examined",
+        "returned",
+        "explained_at",
+    )
+
+    def __init__(self, shape: str):
+        self.shape = shape
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.plan: Optional[str] = None
+        self.keys_examined: Optional[int] = None
+        self.docs_examined: Optional[int] = None
+        self.returned: Optional[int] = None
+        self.explained_at: Optional[float] = None
+
+    @property
+    def needs_index(self) -> bool:
+        """Whether the plan scans the collection or sorts in memory."""
+        return bool(self.plan and re.search(r"\b(?:COLLSCAN|SORT)\b", self.plan))
+
+
+def _query_shape(value):
+    if isinstance(value, dict):
+        return {k: _query_shape(v) for k, v in value.items()}
+    if isinstance(value, list) and value and all(isinstance(v, dict) for v in value):
+        return [_query_shape(v) for v in value]
+    return "?"
+
+
+def _profile_query(
+    mongo_filter: dict,
+    sort: Optional[list],
+    limit: int,
+    projection: dict,
+    started: float,
+) -> None:
+    """Record a query that began at ``started`` if it was slow."""
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    if not settings.SLOW_QUERY_MS or elapsed_ms < settings.SLOW_QUERY_MS:
+        return
+
+    shape = json.dumps(_query_shape(mongo_filter), sort_keys=True)
+    if sort:
+        shape += f" sort {json.dumps(dict(sort))}"
+    entry = _slow_queries.get(shape)
+    if entry is None:
+        if len(_slow_queries) >= SLOW_QUERY_SHAPES:
+            rarest = min(_slow_queries.values(), key=lambda e: e.count)
+            del _slow_queries[rarest.shape]
+        entry = _slow_queries[shape] = SlowQuery(shape)
+    entry.count += 1
+    entry.total_ms += elapsed_ms
+    entry.max_ms = max(entry.max_ms, elapsed_ms)
+
+    now = time.monotonic()
+    if entry.explained_at is None or now - entry.explained_at >= SLOW_QUERY_EXPLAIN_INTERVAL:
+        entry.explained_at = now
+        task = asyncio.create_task(_explain(entry, mongo_filter, sort, limit, projection))
+        _explain_tasks.add(task)
+        task.add_done_callback(_explain_tasks.discard)
+
+
+async def _explain(
+    entry: SlowQuery, mongo_filter: dict, sort, limit: int, projection: dict
+) -> None:
+    cursor = _search_collections()[0].find(mongo_filter, projection).limit(limit)
+    if sort:
+        cursor = cursor.sort(sort)
+    try:
+        explain = await cursor.explain()
+    except Exception:
+        logger.exception("Could not explain slow search %s", entry.shape)
+        return
+
+    plan = explain.get("queryPlanner", {}).get("winningPlan", {})
+    # The slot-based engine nests the classic plan tree.
+    entry.plan = _plan_stages(plan.get("queryPlan", plan))
+    stats = explain.get("executionStats", {})
+    entry.keys_examined = stats.get("totalKeysExamined")
+    entry.docs_examined = stats.get("totalDocsExamined")
+    entry.returned = stats.get("nReturned")
+    logger.warning(
+        "Slow search, %s runs, max %.0f ms: %s -> %s (%s keys, %s docs examined, %s returned)",
+        entry.count,
+        entry.max_ms,
+        entry.shape,
+        entry.plan,
+        entry.keys_examined,
+        entry.docs_examined,
+        entry.returned,
+    )
+
+
+def _plan_stages(plan: dict) -> str:
+    """Explain plan tree as "IXSCAN tokens_1 > FETCH > LIMIT"."""
+    stage = plan.get("stage", "?")
+    if plan.get("indexName"):
+        stage += f" {plan['indexName']}"
+    if plan.get("inputStage"):
+        return f"{_plan_stages(plan['inputStage'])} > {stage}"
+    if plan.get("inputStages"):
+        return f"{stage}({', '.join(_plan_stages(p) for p in plan['inputStages'])})"
+    return stage
+
+
+def slow_query_report(limit: int = 10) -> List[SlowQuery]:
+    """Slow query shapes by total time spent, for the admin command."""
+    return sorted(_slow_queries.values(), key=lambda e: e.total_ms, reverse=True)[:limit]
+
+
 # ─── Search Engine ───────────────────────────────────────────────────────
+# Fields read when rendering result buttons; captions can be large HTML
+# and are only fetched for callers that show them.
+RESULT_FIELDS = {"file_name": 1, "file_size": 1, "file_type": 1}
+
+
+class SearchResult:
+    """Projected search row with the attributes result lists render.
+
+    Built straight from the raw Motor document, skipping umongo
+    deserialization; ``get_file_details`` still returns full ``Media``.
+    """
+
+    __slots__ = ("file_id", "file_name", "file_size", "file_type", "caption")
+
+    def __init__(self, doc: dict):
+        self.file_id = doc["_id"]
+        self.file_name = doc.get("file_name")
+        self.file_size = doc.get("file_size")
+        self.file_type = doc.get("file_type")
+        self.caption = doc.get("caption")
+
+
 async def get_search_results(
     query: str,
     file_type: str = None,
     max_results: int = 10,
-    offset: int = 0,
+    offset: Union[int, str] = 0,
     filter: bool = False,
+    mode: Optional[str] = None,
+    group: bool = False,
+    with_caption: bool = False,
+    prefix: bool = False,
+    timeout_ms: Optional[int] = None,
+    sort: Optional[str] = None,
+) -> SearchPage:
+    """Return ``(files, next_offset, total)`` for a search query.
+
+    ``offset`` is either a numeric skip or a page token previously returned
+    as ``next_offset``; ``next_offset`` is ``""`` on the last page. Pages are
+    served from an in-process cache until a new file is saved. ``mode``
+    overrides ``SEARCH_MODE`` for this call.
+
+    Files are ``SearchResult`` rows; ``caption`` is only loaded with
+    ``with_caption``. With ``group`` the page holds one ``TitleGroup`` per
+    title instead; ``total`` then counts titles. With ``prefix`` the last
+    word may be incomplete, as while typing an inline query.
+
+    ``sort`` (default ``SEARCH_SORT``) names a ``SORT_MODES`` order for the
+    ``SORTABLE_MODES``; relevance-ranked modes and groups keep their own.
+
+    Token-based modes search the canonical query (see ``_query_key``), so
+    spellings that fold to the same words share one cached page.
+
+    Mongo work is bounded by ``timeout_ms`` (default ``SEARCH_TIMEOUT_MS``,
+    0 for none); see ``SearchPage.partial``.
+    """
+    mode = _search_mode(mode)
+    if timeout_ms is None:
+        timeout_ms = settings.SEARCH_TIMEOUT_MS
+    query = _query_key(query, mode)
+    sort = (settings.SEARCH_SORT if sort is None else sort).lower()
+    key = (
+        _search_generation,
+        mode,
+        query,
+        file_type,
+        max_results,
+        str(offset or 0),
+        group,
+        with_caption,
+        prefix,
+        sort,
+    )
+    if not offset:
+        hot = _hot_page(key)
+        if hot is not None:
+            return hot
+
+    cached = _result_cache.get(key)
+    if cached is not None:
+        SEARCH_STATS["cache_hits"] += 1
+        return cached
+
+    SEARCH_STATS["cache_misses"] += 1
+    result = await _inflight.do(
+        key,
+        _timed_search,
+        timeout_ms,
+        query,
+        file_type,
+        max_results,
+        offset,
+        mode,
+        group,
+        with_caption,
+        prefix,
+        sort,
+    )
+    if settings.SEARCH_CACHE_SIZE and not result.partial:
+        _result_cache.set(key, result)
+    if not offset:
+        _fill_hot_page(key, result)
+    return result
+
+
+def _search_mode(mode: Optional[str] = None) -> str:
+    """``mode`` (default ``SEARCH_MODE``) as it is searched.
+
+    Word index modes only know file names, so with ``USE_CAPTION_FILTER``
+    they give way to the regex scan instead of dropping caption matches.
+    """
+    mode = (mode or settings.SEARCH_MODE).lower()
+    if settings.USE_CAPTION_FILTER and mode in FOLDED_MODES:
+        return "regex"
+    return mode
+
+
+def _query_key(query: str, mode: str) -> str:
+    """The query as searched and cached.
+
+    Token-based modes match folded tokens, so they get the canonical query
+    (see ``database.canonical``). The regex and text modes, also used until
+    the search fields are backfilled, match the stored file names with
+    their accents and apostrophes, so they keep the typed spelling.
+    """
+    if mode in FOLDED_MODES and _search_fields_ready:
+        return canonical_query(query)
+    return " ".join(query.lower().split())
+
+
+async def _timed_search(timeout_ms: int, *args) -> SearchPage:
+    return await _with_deadline(timeout_ms, _backend.search, *args)
+
+
+async def _with_deadline(timeout_ms: int, search, *args) -> SearchPage:
+    # Runs in its own task (a singleflight or the hot query refresh), so
+    # the deadline stays local to this search.
+    deadline = _Deadline(timeout_ms) if timeout_ms else None
+    _deadline.set(deadline)
+
+    page = await search(*args)
+    if not isinstance(page, SearchPage):
+        page = SearchPage(page)
+    if deadline is not None and deadline.expired:
+        page.partial = True
+        SEARCH_STATS["timeouts"] += 1
+    return page
+
+
+async def _search(
+    query: str,
+    file_type: Optional[str],
+    max_results: int,
+    offset: Union[int, str],
+    mode: str,
+    group: bool = False,
+    with_caption: bool = False,
+    prefix: bool = False,
+    sort: str = "",
 ):
     query = query.strip()
+    tokens = tokenize(canonical_query(query))
+    projection = {**RESULT_FIELDS, "caption": 1} if with_caption else RESULT_FIELDS
+
+    if group and mode not in ("tokens", "text", "regex"):
+        # Grouping is an aggregation over a find-style filter.
+        mode = "tokens"
 
+    partial = None
+    if prefix:
+        tokens, partial = _split_prefix(tokens)
+        if partial and mode not in ("tokens", "ranked", "memory"):
+            # Prefix lookups are answered by the token indexes, or by the
+            # regex scan while captions are searched.
+            mode = "regex" if settings.USE_CAPTION_FILTER else "tokens"
+
+    if mode == "memory":
+        if _memory is not None and (tokens or partial):
+            return await _memory_search(
+                tokens, file_type, max_results, offset, projection, partial
+            )
+        mode = "tokens"
+
+    if mode == "trigram" and not TRIGRAMS_ENABLED:
+        mode = "tokens"
+    if not (tokens or partial) or (mode in INDEXED_MODES and not _search_fields_ready):
+        mode = "regex"
+
+    count_key = (_search_generation, mode, query.lower(), file_type, group, partial)
+
+    if mode == "trigram":
+        return await _trigram_search(
+            query, file_type, max_results, offset, count_key, projection
+        )
+
+    plan = _plan_query(query, tokens, file_type, mode, partial)
+    if plan is None:
+        return [], "", 0
+    mongo_filter, order, tokens = plan
+
+    if group:
+        return await _grouped_search(mongo_filter, max_results, offset, count_key)
+    if mode == "ranked":
+        return await _ranked_search(
+            tokens, mongo_filter, max_results, offset, count_key, projection
+        )
+    if mode in SORTABLE_MODES and sort in SORT_MODES:
+        order = SORT_MODES[sort]
+    return await _find_page(mongo_filter, order, max_results, offset, count_key, projection)
+
+
+# Whitespace and the separators ``display_name`` turns into spaces.
+WORD_SEPARATORS = re.compile(r"[\s_\-\.\+]+")
+
+
+def _split_prefix(tokens: List[str]) -> Tuple[List[str], Optional[str]]:
+    """Split off the incomplete last word of a query typed so far.
+
+    Words shorter than ``PREFIX_MIN_LENGTH`` are dropped, unless they are
+    the whole query.
+    """
+    if not tokens:
+        return tokens, None
+    *rest, last = tokens
+    if len(last) >= PREFIX_MIN_LENGTH:
+        return rest, last
+    return rest or [last], None
+
+
+def _plan_query(
+    query: str,
+    tokens: List[str],
+    file_type: Optional[str],
+    mode: str,
+    partial: Optional[str] = None,
+):
+    """Build ``(mongo_filter, sort, title_tokens)`` for a find-style mode.
+
+    ``partial`` is an incomplete last word, matched as a token prefix.
+    Returns None when the query cannot match anything.
+    """
+    # Year, season/episode, resolution and language words become equality
+    # filters on the fields extracted at ingest; the rest is the title.
+    tag_filter = {}
+    if _search_fields_ready:
+        tag_filter, title_tokens = media_tags.parse_query(tokens)
+        if tag_filter:
+            tokens = title_tokens
+            # Drop the tag words but keep the typed spelling of the title,
+            # which the regex modes match against unfolded file names.
+            title = set(title_tokens)
+            query = " ".join(
+                word
+                for word in WORD_SEPARATORS.split(query)
+                if word and set(tokenize(word)) <= title
+            )
+
+    if mode in ("tokens", "ranked") and _definitely_absent(tokens):
+        SEARCH_STATS["bloom_rejects"] += 1
+        return None
+
+    if file_type:
+        tag_filter["file_type"] = file_type
+
+    sort = [("_id", -1)]
+
+    if mode in ("tokens", "ranked"):
+        mongo_filter = {"tokens": {"$all": tokens}} if tokens else {}
+        if partial:
+            # An anchored regex is answered by a range scan of the tokens
+            # index, like an edge n-gram lookup without storing the n-grams.
+            prefix_filter = {"tokens": {"$regex": f"^{re.escape(partial)}"}}
+            mongo_filter = (
+                {"$and": [mongo_filter, prefix_filter]} if tokens else prefix_filter
+            )
+    else:
+        regex = _query_regex(query, prefix=partial is not None)
+        if regex is None:
+            return None
+        mongo_filter = _regex_filter(regex)
+
+        if mode == "text":
+            # The text index finds candidates; the regex keeps the phrase
+            # and word-order semantics of the regex mode.
+            mongo_filter = {"$text": {"$search": query}, **mongo_filter}
+            sort = [("score", {"$meta": "textScore"})] + sort
+
+    mongo_filter.update(tag_filter)
+    return mongo_filter, sort, tokens
+
+
+# ─── Search Backends ─────────────────────────────────────────────────────
+class SearchBackend(abc.ABC):
+    """Engine behind ``get_search_results`` and ``get_file_details``.
+
+    ``search`` takes the arguments of ``_search`` and returns
+    ``(files, next_offset, total)``; ``file_details`` returns the raw
+    document of a file or None. ``save_file`` passes every new document
+    to ``add`` once it is stored in Mongo.
+    """
+
+    name = ""
+
+    @abc.abstractmethod
+    async def search(
+        self, query, file_type, max_results, offset, mode, group, with_caption, prefix, sort
+    ):
+        ...
+
+    @abc.abstractmethod
+    async def file_details(self, file_id: str) -> Optional[dict]:
+        ...
+
+    async def add(self, doc: dict) -> None:
+        pass
+
+
+class MongoBackend(SearchBackend):
+    """The ``SEARCH_MODE`` searches, run against every media database."""
+
+    name = "mongo"
+
+    async def search(self, *args):
+        return await _search(*args)
+
+    async def file_details(self, file_id: str) -> Optional[dict]:
+        main, *shards = _search_collections()
+        doc = await main.find_one({"_id": file_id})
+        if doc is None and shards:
+            docs = await asyncio.gather(*(coll.find_one({"_id": file_id}) for coll in shards))
+            doc = next((d for d in docs if d), None)
+        return doc
+
+
+class SqliteBackend(SearchBackend):
+    """BM25 full-text search in a local SQLite FTS5 file.
+
+    Searches and file lookups do not touch Mongo. ``mode``, ``group`` and
+    ``sort`` do not apply here, and captions are always returned.
+    """
+
+    name = "sqlite"
+
+    def __init__(self, path: str):
+        self.path = path
+        self.index: Optional[sqlite_index.SqliteIndex] = None
+
+    async def open(self) -> None:
+        self.index = await asyncio.to_thread(sqlite_index.SqliteIndex, self.path)
+
+    async def sync(self, batch_size: int = 1000) -> int:
+        """Copy files the local index is missing out of Mongo."""
+        if len(self.index) >= await count_files():
+            return 0
+
+        added = 0
+        batch = []
+        async for doc in _scan_all(SQLITE_FIELDS):
+            batch.append(doc)
+            if len(batch) >= batch_size:
+                added += await asyncio.to_thread(self.index.add_many, batch)
+                batch = []
+        if batch:
+            added += await asyncio.to_thread(self.index.add_many, batch)
+        return added
+
+    async def search(
+        self, query, file_type, max_results, offset, mode, group, with_caption, prefix, sort
+    ):
+        tokens = tokenize(canonical_query(query))
+        partial = None
+        if prefix:
+            tokens, partial = _split_prefix(tokens)
+        match = sqlite_index.match_expression(tokens, partial)
+
+        skip, _ = decode_offset(offset)
+        rows = await asyncio.to_thread(
+            self.index.search, match, file_type, skip, max_results + 1
+        )
+        has_more = len(rows) > max_results
+        files = [SearchResult(row) for row in rows[:max_results]]
+
+        next_offset = skip + max_results if has_more else ""
+        if not has_more:
+            total_results = skip + len(files)
+        else:
+            limit = settings.SEARCH_COUNT_LIMIT
+            count_key = (_search_generation, self.name, match, file_type)
+            total_results = await _count_results(
+                count_key,
+                lambda: asyncio.to_thread(
+                    self.index.count, match, file_type, limit + 1 if limit else None
+                ),
+            )
+        return files, next_offset, total_results
+
+    async def file_details(self, file_id: str) -> Optional[dict]:
+        return await asyncio.to_thread(self.index.get, file_id)
+
+    async def add(self, doc: dict) -> None:
+        await asyncio.to_thread(self.index.add_many, [doc])
+
+
+SQLITE_FIELDS = {field: 1 for field in sqlite_index.COLUMNS[1:]}
+
+_backend: SearchBackend = MongoBackend()
+# Receives new files while it is filled from Mongo at startup.
+_backend_loading: Optional[SearchBackend] = None
+
+
+async def load_search_backend() -> None:
+    """Switch to ``SEARCH_BACKEND`` once it holds every indexed file (startup)."""
+    global _backend, _backend_loading
+
+    name = settings.SEARCH_BACKEND.lower()
+    if name == _backend.name:
+        return
+    if name != SqliteBackend.name:
+        logger.warning("Unknown SEARCH_BACKEND %r; using %s", name, _backend.name)
+        return
+
+    backend = SqliteBackend(settings.SQLITE_INDEX_PATH)
+    await backend.open()
+    _backend_loading = backend
+    try:
+        added = await backend.sync()
+    finally:
+        _backend_loading = None
+
+    _backend = backend
+    _bump_generation()
+    logger.info("Search backend %s ready (%s files copied from Mongo)", name, added)
+
+
+async def _feed_backends(doc: dict) -> None:
+    for backend in (_backend, _backend_loading):
+        if backend is None:
+            continue
+        try:
+            await backend.add(doc)
+        except Exception:
+            logger.exception("Could not add %s to the %s search backend", doc["_id"], backend.name)
+
+
+# ─── Pagination ──────────────────────────────────────────────────────────
+PAGE_TOKEN_PREFIX = "k"
+SORT_TOKEN_PREFIX = "s"
+
+# Result orders for the ``sort`` argument, each ending on ``_id`` so that
+# pages can continue after the last row. ``_id`` is an encoded file id,
+# so plain ``_id`` order is stable but not chronological. Fields sorted
+# ascending must be present on every file.
+SORT_MODES = {
+    "newest": [("indexed_at", -1), ("_id", -1)],
+    "largest": [("file_size", -1), ("_id", -1)],
+    "smallest": [("file_size", 1), ("_id", 1)],
+}
+# Modes served by ``_find_page`` in ``_id`` order unless sorted otherwise.
+SORTABLE_MODES = {"tokens", "regex"}
+# Sort fields holding dates; their tokens store milliseconds since epoch.
+DATE_SORT_FIELDS = {"indexed_at"}
+EPOCH = datetime(1970, 1, 1)
+
+
+def encode_page_token(last_id: str) -> str:
+    """Continuation token pointing after ``last_id`` in ``_id`` order."""
+    return f"{PAGE_TOKEN_PREFIX}{last_id}"
+
+
+def encode_sort_token(doc: dict, field: str) -> str:
+    """Continuation token pointing after ``doc`` in a ``SORT_MODES`` order."""
+    value = doc.get(field)
+    if isinstance(value, datetime):
+        value = (value.replace(tzinfo=None) - EPOCH) // timedelta(milliseconds=1)
+    return f"{SORT_TOKEN_PREFIX}{'' if value is None else value}:{doc['_id']}"
+
+
+def decode_offset(offset: Union[int, str, None]) -> Tuple[int, Union[str, tuple, None]]:
+    """Split an offset into ``(skip, after)``; one of them is unused.
+
+    ``after`` is the last id of an ``_id`` ordered page, or a
+    ``(value, id)`` pair for pages in a ``SORT_MODES`` order.
+    """
+    if isinstance(offset, str):
+        if offset.startswith(PAGE_TOKEN_PREFIX):
+            return 0, offset[len(PAGE_TOKEN_PREFIX):]
+        if offset.startswith(SORT_TOKEN_PREFIX):
+            value, _, last_id = offset[len(SORT_TOKEN_PREFIX):].partition(":")
+            return 0, (int(value) if value else None, last_id)
+        return (int(offset) if offset.isdigit() else 0), None
+    return int(offset or 0), None
+
+
+def _page_token(doc: dict, sort: list) -> str:
+    field = sort[0][0]
+    return encode_page_token(doc["_id"]) if field == "_id" else encode_sort_token(doc, field)
+
+
+def _keyset_filter(sort: list, after) -> Optional[dict]:
+    """Filter for the rows following a page token in ``sort`` order.
+
+    None when the token belongs to another order, e.g. after ``SEARCH_SORT``
+    changed; paging then restarts.
+    """
+    field, direction = sort[0]
+    if field == "_id":
+        return {"_id": {"$lt": after}} if isinstance(after, str) else None
+    if not isinstance(after, tuple):
+        return None
+
+    value, last_id = after
+    op = "$lt" if direction < 0 else "$gt"
+    if value is None:
+        # Files without the field come last in descending order.
+        return {field: None, "_id": {op: last_id}}
+    if field in DATE_SORT_FIELDS:
+        value = EPOCH + timedelta(milliseconds=value)
+    following = [{field: {op: value}}, {field: value, "_id": {op: last_id}}]
+    if direction < 0:
+        following.append({field: None})
+    return {"$or": following}
+
+
+def _row_order(sort: list):
+    """``(key, reverse)`` that merges rows of several databases in ``sort`` order."""
+    field, direction = sort[0]
+    if field == "_id":
+        return (lambda doc: doc["_id"]), True
+    return (lambda doc: (doc.get(field) is not None, doc.get(field), doc["_id"])), direction < 0
+
+
+def format_total(total: int, per_page: int = 1) -> str:
+    """Render a result (or page) count, marking capped counts with "+"."""
+    limit = settings.SEARCH_COUNT_LIMIT
+    if limit and total > limit:
+        return f"{math.ceil(limit / per_page)}+"
+    return str(math.ceil(total / per_page))
+
+
+def _query_regex(query: str, prefix: bool = False):
     if not query:
         pattern = ".*"
     elif " " not in query:
-        pattern = rf"(\b|[.\+\-_]){re.escape(query)}(\b|[.\+\-_])"
+        pattern = rf"(\b|[.\+\-_]){re.escape(query)}"
+        if not prefix:
+            pattern += r"(\b|[.\+\-_])"
     else:
         pattern = re.escape(query).replace(r"\ ", r".*[\s.\+\-_]")
 
     try:
-        regex = re.compile(pattern, flags=re.IGNORECASE)
+        return re.compile(pattern, flags=re.IGNORECASE)
     except re.error:
-        return [], "", 0
+        return None
+
 
+def _regex_filter(regex) -> dict:
     if settings.USE_CAPTION_FILTER:
-        mongo_filter = {"$or": [{"file_name": regex}, {"caption": regex}]}
+        return {"$or": [{"file_name": regex}, {"caption": regex}]}
+    return {"file_name": regex}
+
+
+async def _find_page(
+    mongo_filter: dict,
+    sort: list,
+    max_results: int,
+    offset: Union[int, str],
+    count_key: tuple,
+    projection: dict = RESULT_FIELDS,
+):
+    """Fetch one page, paging by keyset when the sort allows it.
+
+    Pages sorted by ``_id`` or a ``SORT_MODES`` order continue after the
+    last row seen, so deep pages cost the same as the first one and stay
+    stable while new files are indexed. Other sorts (e.g. text score) fall
+    back to skip/limit.
+    """
+    skip, after = decode_offset(offset)
+    keyset = sort == [("_id", -1)] or sort in SORT_MODES.values()
+
+    page_filter = mongo_filter
+    following = _keyset_filter(sort, after) if keyset and after else None
+    if following:
+        page_filter = {"$and": [mongo_filter, following]}
     else:
-        mongo_filter = {"file_name": regex}
+        after = None
 
-    if file_type:
-        mongo_filter["file_type"] = file_type
+    reverse = True
+    if sort[0][0] == "score":
+        # Mongo before 4.4 needs a sorted textScore in the projection.
+        projection = {**projection, "score": {"$meta": "textScore"}}
+        key = lambda doc: (doc["score"], doc["_id"])
+    else:
+        key, reverse = _row_order(sort)
+        projection = {**projection, sort[0][0]: 1}
+
+    async def fetch(coll, skip, limit):
+        cursor = _find(coll, page_filter, projection).sort(sort).skip(skip).limit(limit)
+        return await _read(cursor, limit)
 
-    total_results = await Media.count_documents(mongo_filter)
-    next_offset = offset + max_results
-    if next_offset >= total_results:
+    started = time.perf_counter()
+    docs = await _merged_rows(fetch, skip, max_results + 1, key, reverse)
+    _profile_query(page_filter, sort, max_results + 1, projection, started)
+    has_more = len(docs) > max_results
+    docs = docs[:max_results]
+    files = [SearchResult(doc) for doc in docs]
+
+    if not has_more:
         next_offset = ""
+    elif keyset:
+        next_offset = _page_token(docs[-1], sort)
+    else:
+        next_offset = skip + max_results
+
+    if not has_more and not after:
+        total_results = skip + len(files)
+    else:
+        total_results = await _count_results(
+            count_key, lambda: _bounded_count(mongo_filter)
+        )
+        if total_results is None:
+            total_results = skip + len(files) + has_more
+
+    return files, next_offset, total_results
+
+
+_count_cache = TTLCache(maxsize=2048, ttl=settings.CACHE_TIME)
+
+
+async def _count_results(count_key: tuple, counter) -> Optional[int]:
+    """Match count from ``counter()``, cached per query across pages.
+
+    Counters stop at ``SEARCH_COUNT_LIMIT + 1`` so large result sets cost a
+    bounded scan; ``format_total`` renders such counts as "N+". None means
+    the count ran past the search deadline.
+    """
+    total = _count_cache.get(count_key)
+    if total is None:
+        total = await counter()
+        if total is not None:
+            _count_cache.set(count_key, total)
+    return total
+
+
+async def _bounded_count(mongo_filter: dict) -> Optional[int]:
+    limit = settings.SEARCH_COUNT_LIMIT
+    started = time.perf_counter()
+    kwargs = {"limit": limit + 1} if limit else {}
+
+    async def count(coll):
+        left = _time_left_ms()
+        try:
+            if left is None:
+                return await coll.count_documents(mongo_filter, **kwargs)
+            return await coll.count_documents(mongo_filter, maxTimeMS=left, **kwargs)
+        except ExecutionTimeout:
+            _mark_timed_out()
+            return None
+
+    counts = await _fan_out(count)
+    _profile_query(mongo_filter, None, limit + 1 if limit else 0, {"_id": 1}, started)
+    return None if None in counts else sum(counts)
 
-    cursor = (
-        Media.find(mongo_filter)
-        .sort("_id", -1)
-        .skip(offset)
-        .limit(max_results)
+
+async def _trigram_search(
+    query: str,
+    file_type: Optional[str],
+    max_results: int,
+    offset: Union[int, str],
+    count_key: tuple,
+    projection: dict = RESULT_FIELDS,
+):
+    """Rank files by how many of the query's trigrams their name shares.
+
+    A file qualifies when it contains ``SEARCH_TRIGRAM_THRESHOLD`` of the
+    query trigrams, so partial words and single typos still match. Such a
+    file misses at most ``len(grams) - min_overlap`` grams, so it holds at
+    least one of any ``len(grams) - min_overlap + 1`` of them: candidates
+    are looked up on the ``trigrams`` index by only that many of the
+    rarest grams, never by common word-boundary grams like " th".
+    """
+    grams = trigrams(query)
+    min_overlap = max(1, math.ceil(len(grams) * settings.SEARCH_TRIGRAM_THRESHOLD))
+
+    df = await _gram_frequencies(grams)
+    present = sorted((g for g in grams if df[g]), key=lambda g: (df[g], " " in g))
+    if len(present) < min_overlap:
+        return [], "", 0
+
+    match = {"trigrams": {"$in": present[: len(present) - min_overlap + 1]}}
+    if file_type:
+        match["file_type"] = file_type
+
+    candidates = [
+        {"$match": match},
+        {"$addFields": {"overlap": {"$size": {"$setIntersection": ["$trigrams", grams]}}}},
+        {"$match": {"overlap": {"$gte": min_overlap}}},
+    ]
+    ranking = [
+        {"$addFields": {"gram_count": {"$size": "$trigrams"}}},
+        {"$sort": {"overlap": -1, "gram_count": 1, "_id": -1}},
+        {"$project": {**projection, "overlap": 1, "gram_count": 1}},
+    ]
+    return await _aggregate_page(
+        candidates,
+        ranking,
+        max_results,
+        offset,
+        count_key,
+        key=lambda row: (row["overlap"], -row["gram_count"], row["_id"]),
     )
 
-    files = await cursor.to_list(length=max_results)
+
+# Trigram counts stop here; grams this common are equally poor lookups.
+GRAM_COUNT_LIMIT = 10_000
+_gram_df_cache = TTLCache(maxsize=16384, ttl=3600)
+
+
+async def _gram_frequencies(grams: List[str]) -> dict:
+    """Files containing each trigram, capped at ``GRAM_COUNT_LIMIT``.
+
+    Absent grams are not cached: the next upload may contain them, and a
+    cached zero would drop them from lookups until it expired.
+    """
+    df = {g: _gram_df_cache.get(g) for g in grams}
+
+    async def count(gram):
+        counts = await _fan_out(
+            lambda coll: coll.count_documents({"trigrams": gram}, limit=GRAM_COUNT_LIMIT)
+        )
+        df[gram] = sum(counts)
+        if df[gram]:
+            _gram_df_cache.set(gram, df[gram])
+
+    await asyncio.gather(*(count(g) for g, n in df.items() if n is None))
+    return df
+
+
+_ranked_cache = TTLCache(maxsize=512, ttl=settings.SEARCH_CACHE_TTL)
+
+
+async def _ranked_search(
+    tokens: List[str],
+    match: dict,
+    max_results: int,
+    offset: Union[int, str],
+    count_key: tuple,
+    projection: dict = RESULT_FIELDS,
+):
+    """Order token matches by name length with title and year boosts.
+
+    The ``SEARCH_RANK_CANDIDATES`` most recently indexed matches are scored
+    once per query; the ranked id list is cached so further pages only
+    hydrate their slice.
+    """
+    ranked = _ranked_cache.get(count_key)
+    if ranked is None:
+        limit = settings.SEARCH_RANK_CANDIDATES
+        order = SORT_MODES["newest"]
+
+        async def fetch(coll):
+            cursor = _find(coll, match, {"tokens": 1, "indexed_at": 1}).sort(order).limit(limit)
+            return await _read(cursor, limit)
+
+        key, reverse = _row_order(order)
+        newest = heapq.merge(*await _fan_out(fetch), key=key, reverse=reverse)
+        candidates = [
+            (doc["_id"], doc.get("tokens") or [])
+            for doc in itertools.islice(_unique(newest), limit)
+        ]
+        ranked = ranking.rank(tokens, candidates)
+        deadline = _deadline.get()
+        if deadline is None or not deadline.expired:
+            _ranked_cache.set(count_key, ranked)
+
+    skip, _ = decode_offset(offset)
+    files = await _hydrate(ranked[skip:skip + max_results], projection)
+    next_offset = skip + max_results if skip + max_results < len(ranked) else ""
+    return files, next_offset, len(ranked)
+
+
+async def _aggregate_page(
+    candidates: list,
+    ranking: list,
+    max_results: int,
+    offset: Union[int, str],
+    count_key: tuple,
+    key,
+    build=SearchResult,
+):
+    """Skip/limit page over an aggregation; ``candidates`` also feeds the count.
+
+    ``key`` gives the descending order ``ranking`` sorts rows in, used to
+    merge the pages of several media databases.
+    """
+    skip, _ = decode_offset(offset)
+
+    async def fetch(coll, skip, limit):
+        pipeline = candidates + ranking + [{"$skip": skip}, {"$limit": limit}]
+        return await _read(_aggregate(coll, pipeline), limit)
+
+    docs = await _merged_rows(fetch, skip, max_results + 1, key)
+    has_more = len(docs) > max_results
+    files = [build(doc) for doc in docs[:max_results]]
+
+    next_offset = skip + max_results if has_more else ""
+    if not has_more:
+        total_results = skip + len(files)
+    else:
+        total_results = await _count_results(
+            count_key, lambda: _aggregate_count(candidates)
+        )
+        if total_results is None:
+            total_results = skip + len(files) + has_more
+
     return files, next_offset, total_results
 
 
+async def _aggregate_count(candidates: list) -> Optional[int]:
+    limit = settings.SEARCH_COUNT_LIMIT
+    pipeline = candidates + ([{"$limit": limit + 1}] if limit else []) + [{"$count": "n"}]
+
+    async def count(coll):
+        try:
+            result = await _aggregate(coll, pipeline).to_list(length=1)
+        except ExecutionTimeout:
+            _mark_timed_out()
+            return None
+        return result[0]["n"] if result else 0
+
+    counts = await _fan_out(count)
+    return None if None in counts else sum(counts)
+
+
+# ─── Grouped Results ─────────────────────────────────────────────────────
+class TitleGroup:
+    """One grouped search row: a title and the newest of its files.
+
+    ``file_id``, ``file_name`` and ``file_size`` describe the most recently
+    indexed file so a group of one renders like a plain result.
+    """
+
+    __slots__ = ("key", "count", "file_id", "file_name", "file_size", "file_type")
+
+    def __init__(self, row: dict):
+        self.key = row["_id"]
+        self.count = row["count"]
+        self.file_id = row["file_id"]
+        self.file_name = row["file_name"]
+        self.file_size = row["file_size"]
+        self.file_type = row.get("file_type")
+
+
+async def _grouped_search(
+    mongo_filter: dict,
+    max_results: int,
+    offset: Union[int, str],
+    count_key: tuple,
+):
+    """Collapse matching files into one row per ``group_key``, newest first.
+
+    A group is represented and ordered by its most recently indexed file;
+    file ids are not in upload order. Files without a group key stay on
+    their own by grouping on ``_id``.
+    With several media databases a title is counted once per database in
+    ``total``, while the version counts on the page are exact.
+    """
+    candidates = [
+        {"$match": mongo_filter},
+        {"$sort": dict(SORT_MODES["newest"])},
+        {
+            "$group": {
+                "_id": {"$ifNull": ["$group_key", "$_id"]},
+                "count": {"$sum": 1},
+                "indexed_at": {"$first": "$indexed_at"},
+                "file_id": {"$first": "$_id"},
+                "file_name": {"$first": "$file_name"},
+                "file_size": {"$first": "$file_size"},
+                "file_type": {"$first": "$file_type"},
+            }
+        },
+    ]
+    ranking = [{"$sort": {"indexed_at": -1, "file_id": -1}}]
+    files, next_offset, total = await _aggregate_page(
+        candidates,
+        ranking,
+        max_results,
+        offset,
+        count_key,
+        # Files saved before indexed_at was stored come last.
+        key=lambda row: (row["indexed_at"] is not None, row["indexed_at"], row["file_id"]),
+        build=TitleGroup,
+    )
+    if files and get_media_shards():
+        await _recount_groups(files, mongo_filter)
+    return files, next_offset, total
+
+
+async def _recount_groups(groups: List[TitleGroup], mongo_filter: dict) -> None:
+    """Sum version counts of titles whose files span several databases."""
+    pipeline = [
+        {"$match": {**mongo_filter, "group_key": {"$in": [g.key for g in groups]}}},
+        {"$group": {"_id": "$group_key", "count": {"$sum": 1}}},
+    ]
+    counts = Counter()
+    for rows in await _fan_out(lambda coll: coll.aggregate(pipeline).to_list(length=None)):
+        for row in rows:
+            counts[row["_id"]] += row["count"]
+    for group in groups:
+        group.count = counts.get(group.key, group.count)
+
+
+async def get_group_versions(
+    group_key: str,
+    file_type: Optional[str] = None,
+    query: Optional[str] = None,
+    limit: int = 30,
+) -> List[SearchResult]:
+    """Files of one grouped title, largest first.
+
+    With the ``query`` the group came from, its tag words (quality,
+    languages, ...) narrow the versions like they narrowed the search.
+    """
+    mongo_filter = {"group_key": group_key}
+    if query:
+        tag_filter, _ = media_tags.parse_query(tokenize(canonical_query(query)))
+        mongo_filter.update(tag_filter)
+    if file_type:
+        mongo_filter["file_type"] = file_type
+
+    async def fetch(coll, skip, limit):
+        cursor = coll.find(mongo_filter, RESULT_FIELDS).sort("file_size", -1).limit(limit)
+        return await cursor.to_list(length=limit)
+
+    docs = await _merged_rows(fetch, 0, limit, key=lambda doc: doc["file_size"])
+    return [SearchResult(doc) for doc in docs]
+
+
+# ─── Facets ──────────────────────────────────────────────────────────────
+# Fields counted next to the first page of a search, for filter buttons.
+FACET_FIELDS = ("file_type", "quality", "year")
+# Marks faceted pages in cache and hot query keys.
+FACETS_KEY = "facets"
+
+
+async def get_faceted_results(
+    query: str,
+    file_type: Optional[str] = None,
+    max_results: int = 10,
+    timeout_ms: Optional[int] = None,
+    sort: Optional[str] = None,
+) -> SearchPage:
+    """First result page of a search plus its match counts per facet.
+
+    One ``$facet`` aggregation per media database returns the page, the
+    total and the counts, where a find, a count and a count per facet
+    would otherwise each take a round trip. ``facets`` maps every field of
+    ``FACET_FIELDS`` to ``[(value, count), ...]``, most frequent first.
+    Like the total, the counts only cover the first ``SEARCH_COUNT_LIMIT``
+    matches per database in page order, so a broad query does not read
+    its whole match set; ``facets_capped`` is set when they stopped there
+    and are lower bounds. The page is the one
+    ``get_search_results`` returns, so ``next_offset`` continues there.
+    Frequent searches are served from the hot query pages.
+
+    Modes other than ``SORTABLE_MODES``, other backends and searches before
+    the tag fields are backfilled get a plain page without ``facets``.
+    """
+    mode = _search_mode()
+    if mode not in SORTABLE_MODES or _backend.name != MongoBackend.name or not _search_fields_ready:
+        return await get_search_results(
+            query, file_type, max_results, timeout_ms=timeout_ms, sort=sort
+        )
+
+    if timeout_ms is None:
+        timeout_ms = settings.SEARCH_TIMEOUT_MS
+    query = _query_key(query, mode)
+    sort = (settings.SEARCH_SORT if sort is None else sort).lower()
+    key = (_search_generation, FACETS_KEY, mode, query, file_type, max_results, sort)
+    hot = _hot_page(key)
+    if hot is not None:
+        return hot
+
+    cached = _result_cache.get(key)
+    if cached is not None:
+        SEARCH_STATS["cache_hits"] += 1
+        return cached
+
+    SEARCH_STATS["cache_misses"] += 1
+    result = await _inflight.do(
+        key,
+        _with_deadline,
+        timeout_ms,
+        _faceted_search,
+        query,
+        file_type,
+        max_results,
+        mode,
+        SORT_MODES.get(sort, [("_id", -1)]),
+    )
+    if settings.SEARCH_CACHE_SIZE and not result.partial:
+        _result_cache.set(key, result)
+    _fill_hot_page(key, result)
+    return result
+
+
+async def _faceted_search(
+    query: str, file_type: Optional[str], max_results: int, mode: str, sort: list
+) -> SearchPage:
+    tokens = tokenize(canonical_query(query))
+    if not tokens:
+        mode = "regex"
+    plan = _plan_query(query, tokens, file_type, mode)
+    if plan is None:
+        page = SearchPage(([], "", 0))
+        page.facets = {}
+        return page
+    mongo_filter, _, _ = plan
+
+    limit = settings.SEARCH_COUNT_LIMIT
+    cap = max(limit, max_results) + 1 if limit else 0
+    projection = {**RESULT_FIELDS, sort[0][0]: 1}
+    pipeline = [{"$match": mongo_filter}, {"$sort": dict(sort)}]
+    if cap:
+        pipeline.append({"$limit": cap})
+    pipeline.append({
+        "$facet": {
+            "page": [{"$limit": max_results + 1}, {"$project": projection}],
+            "total": [{"$count": "n"}],
+            **{
+                field: [{"$group": {"_id": f"${field}", "n": {"$sum": 1}}}]
+                for field in FACET_FIELDS
+            },
+        }
+    })
+
+    started = time.perf_counter()
+    results = [
+        rows[0]
+        for rows in await _fan_out(
+            lambda coll: _read(_aggregate(coll, pipeline), 1)
+        )
+        if rows
+    ]
+    _profile_query(mongo_filter, sort, cap, projection, started)
+
+    key, reverse = _row_order(sort)
+    merged = heapq.merge(*(r["page"] for r in results), key=key, reverse=reverse)
+    docs = list(itertools.islice(_unique(merged), max_results + 1))
+    has_more = len(docs) > max_results
+    docs = docs[:max_results]
+    files = [SearchResult(doc) for doc in docs]
+
+    next_offset = _page_token(docs[-1], sort) if has_more else ""
+    if has_more:
+        total = sum(r["total"][0]["n"] for r in results if r["total"])
+    else:
+        total = len(files)
+
+    counts = {field: Counter() for field in FACET_FIELDS}
+    for r in results:
+        for field in FACET_FIELDS:
+            for row in r[field]:
+                if row["_id"] is not None:
+                    counts[field][row["_id"]] += row["n"]
+
+    page = SearchPage((files, next_offset, total))
+    page.facets = {field: counts[field].most_common() for field in FACET_FIELDS}
+    page.facets_capped = bool(cap) and any(
+        r["total"] and r["total"][0]["n"] >= cap for r in results
+    )
+    return page
+
+
 # ─── File Lookup ─────────────────────────────────────────────────────────
 async def get_file_details(file_id: str) -> List[Media]:
-    cursor = Media.find({"file_id": file_id})
-    return await cursor.to_list(length=1)
+    doc = await _backend.file_details(file_id)
+    return [_build_media(doc)] if doc else []
+
+
+def _build_media(doc: dict) -> Media:
+    """Turn a raw document from a search backend into ``Media``."""
+    known = Media.schema.fields
+    return Media.build_from_mongo(
+        {k: v for k, v in doc.items() if k == "_id" or k in known}
+    )
 
 
 # ─── Telegram File ID Encoding ───────────────────────────────────────────
@@ -0,0 +1,178 @@
+"""Release-name tags: year, season/episode, resolution and languages.
+
+The same rules run at ingest, to store the tags as indexed fields, and on
+queries, to turn tags typed by users into equality filters so only the
+real title words are left for free-text matching.
+"""
+
+import re
+from typing import Dict, List, Optional, Tuple
+
+from database.canonical import YEAR
+
+SEASON_EPISODE = re.compile(r"s(\d{1,2})e(\d{1,3})")
+SEASON = re.compile(r"s(\d{1,2})")
+EPISODE = re.compile(r"e(?:p)?(\d{1,3})")
+CROSS_EPISODE = re.compile(r"(\d{1,2})x(\d{2,3})")
+RESOLUTION = re.compile(r"(\d{3,4})p")
+
+QUALITY_ALIASES = {"4k": "2160p", "uhd": "2160p"}
+
+LANGUAGES = {
+    "hindi": "hindi", "hin": "hindi",
+    "english": "english", "eng": "english",
+    "tamil": "tamil", "tam": "tamil",
+    "telugu": "telugu", "tel": "telugu",
+    "malayalam": "malayalam", "mal": "malayalam",
+    "kannada": "kannada", "kan": "kannada",
+    "bengali": "bengali", "bangla": "bengali",
+    "marathi": "marathi",
+    "punjabi": "punjabi",
+    "gujarati": "gujarati",
+    "urdu": "urdu",
+    "korean": "korean",
+    "japanese": "japanese",
+    "chinese": "chinese",
+    "spanish": "spanish",
+    "french": "french",
+    "german": "german",
+    "italian": "italian",
+    "russian": "russian",
+    "arabic": "arabic",
+    "turkish": "turkish",
+    "dual": "dual",
+    "multi": "multi",
+}
+
+# Words that announce the number following them.
+_NUMBER_WORDS = {"season": "season", "episode": "episode", "ep": "episode"}
+
+
+def extract_tags(tokens: List[str]) -> Tuple[Dict, List[str]]:
+    """Split lowercase tokens into a tag dict and the remaining title words.
+
+    Tag keys are ``years``, ``year``, ``season``, ``episode``, ``quality``
+    and ``languages``; only tags that were found are present. A year is
+    only taken once some title word precedes it, so "2012" stays a title.
+    Titles may contain years too ("Wonder.Woman.1984.2020"), so ``years``
+    keeps every candidate and ``year``, the release year, is the last one.
+    """
+    tags: Dict = {}
+    rest: List[str] = []
+    languages: List[str] = []
+    years: List[int] = []
+    pending: Optional[str] = None
+
+    for token in tokens:
+        if pending:
+            word, pending = pending, None
+            if token.isdigit():
+                tags.setdefault(_NUMBER_WORDS[word], int(token))
+                continue
+            rest.append(word)
+
+        if token in _NUMBER_WORDS:
+            pending = token
+            continue
+
+        match = SEASON_EPISODE.fullmatch(token) or CROSS_EPISODE.fullmatch(token)
+        if match:
+            tags.setdefault("season", int(match.group(1)))
+            tags.setdefault("episode", int(match.group(2)))
+            continue
+
+        match = SEASON.fullmatch(token)
+        if match:
+            tags.setdefault("season", int(match.group(1)))
+            continue
+
+        match = EPISODE.fullmatch(token)
+        if match and "season" in tags:
+            tags.setdefault("episode", int(match.group(1)))
+            continue
+
+        if RESOLUTION.fullmatch(token) or token in QUALITY_ALIASES:
+            tags.setdefault("quality", QUALITY_ALIASES.get(token, token))
+            continue
+
+        if token in LANGUAGES:
+            if LANGUAGES[token] not in languages:
+                languages.append(LANGUAGES[token])
+            continue
+
+        if YEAR.fullmatch(token) and rest:
+            if int(token) not in years:
+                years.append(int(token))
+            continue
+
+        rest.append(token)
+
+    if pending:
+        rest.append(pending)
+    if years:
+        tags["years"] = years
+        tags["year"] = years[-1]
+    if languages:
+        tags["languages"] = languages
+    return tags, rest
+
+
+def media_tag_fields(tokens: List[str]) -> Dict:
+    """Tag fields stored on a ``Media`` document (missing tags as None)."""
+    tags, _ = extract_tags(tokens)
+    return {
+        "year": tags.get("year"),
+        "years": tags.get("years", []),
+        "season": tags.get("season"),
+        "episode": tags.get("episode"),
+        "quality": tags.get("quality"),
+        "languages": tags.get("languages", []),
+    }
+
+
+def parse_query(tokens: List[str]) -> Tuple[Dict, List[str]]:
+    """Mongo equality filters for tags in a query, plus its title words.
+
+    When the query would be left without title words, nothing is treated
+    as a tag: "1080p" or "hindi" on their own are searched as text.
+    """
+    tags, rest = extract_tags(tokens)
+    if not rest:
+        return {}, tokens
+
+    filters: Dict = {}
+    if tags.get("years"):
+        # Matched against every year in stored names, so "wonder woman 1984"
+        # finds "Wonder.Woman.1984.2020".
+        filters["years"] = {"$all": tags["years"]}
+    for key in ("season", "episode", "quality"):
+        if key in tags:
+            filters[key] = tags[key]
+    if tags.get("languages"):
+        filters["languages"] = {"$all": tags["languages"]}
+    return filters, rest
+
+
+def group_key(tokens: List[str]) -> Optional[str]:
+    """Key shared by every version of one title, e.g. "dune (2021)".
+
+    Built from the title words before the first tag, the year and, for
+    series, the season and episode; quality and languages are left out so
+    rips of the same release group together.
+    """
+    tags, rest = extract_tags(tokens)
+    # The title is the run of leading tokens that were not taken as tags.
+    end = 0
+    while end < len(rest) and rest[end] == tokens[end]:
+        end += 1
+    if not end:
+        return None
+
+    key = " ".join(tokens[:end])
+    if "year" in tags:
+        key += f" ({tags['year']})"
+    if "season" in tags:
+        key += f" s{tags['season']:02d}"
+        if "episode" in tags:
+            key += f"e{tags['episode']:02d}"
+    return key
@@ -0,0 +1,532 @@
+"""In-process title search engine backed by NumPy arrays.
+
+The corpus is kept as a CSR matrix of token ids per file (``doc_ptr`` /
+``doc_tokens``) plus the inverted posting lists derived from it and compact
+size/type columns. Queries intersect posting lists with vectorized NumPy
+operations; Mongo is only asked to hydrate the file ids of the final page.
+
+Segments can be written to a snapshot file and memory-mapped back, so bot
+processes on one host share a single copy through the page cache.
+"""
+
+import asyncio
+import json
+import logging
+import mmap
+import os
+import struct
+from typing import Iterable, List, Optional, Tuple
+
+try:
+    import numpy as np
+except ImportError:  # optional dependency, only needed for SEARCH_MODE=memory
+    np = None
+
+from database import ranking
+
+logger = logging.getLogger(__name__)
+
+FILE_TYPES = ("", "document", "video", "audio")
+
+# Inserts are buffered in Python lists and folded into the arrays once
+# this many accumulated.
+COMPACT_THRESHOLD = 20_000
+
+# Only the best hits by name length are re-ranked with the title boosts,
+# which need each name's token sequence.
+RERANK_DEPTH = 200
+
+
+def _type_code(file_type: Optional[str]) -> int:
+    try:
+        return FILE_TYPES.index(file_type or "")
+    except ValueError:
+        return 0
+
+
+class Segment:
+    """Immutable arrays describing an indexed corpus."""
+
+    __slots__ = (
+        "vocab",
+        "doc_ptr",
+        "doc_tokens",
+        "post_ptr",
+        "post_docs",
+        "sizes",
+        "types",
+        "ids",
+    )
+
+    def __init__(self, vocab, doc_ptr, doc_tokens, post_ptr, post_docs, sizes, types, ids):
+        self.vocab = vocab
+        self.doc_ptr = doc_ptr
+        self.doc_tokens = doc_tokens
+        self.post_ptr = post_ptr
+        self.post_docs = post_docs
+        self.sizes = sizes
+        self.types = types
+        self.ids = ids
+
+    @classmethod
+    def build(cls, vocab, doc_len, doc_tokens, sizes, types, ids) -> "Segment":
+        """Derive pointers and posting lists from per-file token ids.
+
+        ``vocab`` must be sorted; ``doc_tokens`` holds the token ids of all
+        files back to back, ``doc_len[i]`` of them for file ``i``.
+        """
+        doc_len = np.asarray(doc_len, dtype=np.int64)
+        doc_tokens = np.asarray(doc_tokens, dtype=np.int32)
+        n_docs = len(doc_len)
+
+        doc_ptr = np.zeros(n_docs + 1, dtype=np.int64)
+        np.cumsum(doc_len, out=doc_ptr[1:])
+
+        # A stable sort keeps every posting list in ascending file order.
+        order = np.argsort(doc_tokens, kind="stable")
+        owners = np.repeat(np.arange(n_docs, dtype=np.int32), doc_len)
+        post_docs = owners[order]
+
+        post_ptr = np.zeros(len(vocab) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(doc_tokens, minlength=len(vocab)), out=post_ptr[1:])
+
+        return cls(
+            vocab=vocab,
+            doc_ptr=doc_ptr,
+            doc_tokens=doc_tokens,
+            post_ptr=post_ptr,
+            post_docs=post_docs,
+            sizes=np.asarray(sizes, dtype=np.int64),
+            types=np.asarray(types, dtype=np.int8),
+            ids=ids,
+        )
+
+    @classmethod
+    def empty(cls) -> "Segment":
+        return cls.build(
+            np.array([], dtype="S1"), [], [], [], [], np.array([], dtype="S1")
+        )
+
+    def __len__(self) -> int:
+        return len(self.doc_ptr) - 1
+
+    def token_id(self, token: str) -> int:
+        key = token.encode()
+        pos = int(np.searchsorted(self.vocab, key))
+        if pos < len(self.vocab) and self.vocab[pos] == key:
+            return pos
+        return -1
+
+    def postings(self, token: str):
+        tid = self.token_id(token)
+        if tid < 0:
+            return np.empty(0, dtype=np.int32)
+        return self.post_docs[self.post_ptr[tid]:self.post_ptr[tid + 1]]
+
+    def prefix_postings(self, prefix: str):
+        """Files containing any token that starts with ``prefix``.
+
+        The vocabulary is sorted, so matching tokens form one contiguous
+        range found by two bisections; their postings are adjacent too.
+        """
+        key = prefix.encode()
+        if len(key) > self.vocab.itemsize:
+            return np.empty(0, dtype=np.int32)
+        lo = int(np.searchsorted(self.vocab, key))
+        if len(key) < self.vocab.itemsize:
+            # 0xff never occurs in UTF-8, so it sorts after every extension.
+            hi = int(np.searchsorted(self.vocab, key + b"\xff"))
+        else:
+            hi = int(np.searchsorted(self.vocab, key, side="right"))
+        return np.unique(self.post_docs[self.post_ptr[lo]:self.post_ptr[hi]])
+
+    def doc_lengths(self):
+        return np.diff(self.doc_ptr)
+
+
+# ─── Snapshot Files ──────────────────────────────────────────────────────
+# Layout: magic, little-endian header length, JSON header describing each
+# array (dtype, length, byte offset), then the raw arrays 8-byte aligned.
+# The header also records the schema of the tokens the arrays were built
+# from; a snapshot of another schema is refused when loading.
+SNAPSHOT_MAGIC = b"FLXIDX01"
+_ARRAYS = Segment.__slots__
+
+
+def _align(n: int) -> int:
+    return (n + 7) & ~7
+
+
+def save_segment(segment: Segment, path: str, schema: int = 0) -> Segment:
+    """Atomically write ``segment`` to ``path`` and return it memory-mapped.
+
+    The file is written next to its destination and renamed into place, so
+    processes that still map the previous snapshot keep a valid view. The
+    returned view maps the written file itself, even if another process
+    replaces ``path`` right afterwards.
+    """
+    arrays = {name: np.ascontiguousarray(getattr(segment, name)) for name in _ARRAYS}
+
+    header = {"version": 1, "schema": schema, "arrays": {}}
+    # The header size depends on the offsets it records: size it with
+    # placeholder offsets at least as wide as the real ones.
+    probe = {n: {"dtype": a.dtype.str, "count": len(a), "offset": 10 ** 15} for n, a in arrays.items()}
+    offset = _align(len(SNAPSHOT_MAGIC) + 8 + len(json.dumps({**header, "arrays": probe})))
+    for name, arr in arrays.items():
+        header["arrays"][name] = {"dtype": arr.dtype.str, "count": len(arr), "offset": offset}
+        offset = _align(offset + arr.nbytes)
+    raw_header = json.dumps(header).encode()
+
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    tmp_path = f"{path}.tmp-{os.getpid()}"
+
+    with open(tmp_path, "wb") as f:
+        f.write(SNAPSHOT_MAGIC)
+        f.write(struct.pack("<Q", len(raw_header)))
+        f.write(raw_header)
+        for name, arr in arrays.items():
+            f.seek(header["arrays"][name]["offset"])
+            f.write(arr.tobytes())
+        f.truncate(max(offset, f.tell()))
+        f.flush()
+        os.fsync(f.fileno())
+
+    mapped = load_segment(tmp_path, schema)
+    os.replace(tmp_path, path)
+    return mapped
+
+
+def load_segment(path: str, schema: int = 0) -> Segment:
+    """Memory-map a snapshot written by ``save_segment`` (read-only).
+
+    Raises ValueError when the snapshot was built for another ``schema``.
+    """
+    with open(path, "rb") as f:
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    if mapped[:len(SNAPSHOT_MAGIC)] != SNAPSHOT_MAGIC:
+        raise ValueError(f"{path} is not a title index snapshot")
+
+    start = len(SNAPSHOT_MAGIC)
+    (header_len,) = struct.unpack_from("<Q", mapped, start)
+    header = json.loads(mapped[start + 8:start + 8 + header_len])
+    if header.get("schema", 0) != schema:
+        raise ValueError(
+            f"{path} holds schema {header.get('schema', 0)} tokens, expected {schema}"
+        )
+
+    arrays = {}
+    for name in _ARRAYS:
+        spec = header["arrays"][name]
+        arrays[name] = np.frombuffer(
+            mapped, dtype=np.dtype(spec["dtype"]), count=spec["count"], offset=spec["offset"]
+        )
+    return Segment(**arrays)
+
+
+def _sorted_vocab(tokens: Iterable[str]):
+    encoded = sorted({t.encode() for t in tokens})
+    width = max((len(t) for t in encoded), default=1)
+    return np.array(encoded, dtype=f"S{width}")
+
+
+def _ids_array(ids: List[str]):
+    width = max((len(i) for i in ids), default=1)
+    return np.array([i.encode() for i in ids], dtype=f"S{width}")
+
+
+class TitleIndex:
+    """Token index over file names answering ranked title searches.
+
+    New files land in a small delta buffer that is searched alongside the
+    immutable base segment and merged into it by ``compact``.
+    """
+
+    def __init__(
+        self,
+        base: Optional[Segment] = None,
+        snapshot_path: Optional[str] = None,
+        schema: int = 0,
+    ):
+        self.base = base if base is not None else Segment.empty()
+        self.snapshot_path = snapshot_path
+        # Token schema written into snapshots and required when loading one.
+        self.schema = schema
+        # Identity of the snapshot file behind ``base``, see ``reload``.
+        self._snapshot_seen = self._snapshot_version()
+        self._reset_delta()
+        self._compacting = False
+
+    def _reset_delta(self) -> None:
+        self._delta_ids: List[str] = []
+        self._delta_tokens: List[List[str]] = []
+        self._delta_sizes: List[int] = []
+        self._delta_types: List[int] = []
+        self._delta_post: dict = {}
+
+    def __len__(self) -> int:
+        return len(self.base) + len(self._delta_ids)
+
+    # ─── Building ────────────────────────────────────────────────────────
+    @classmethod
+    def open(cls, path: str, schema: int = 0) -> "TitleIndex":
+        """Index backed by the memory-mapped snapshot at ``path``."""
+        return cls(load_segment(path, schema), snapshot_path=path, schema=schema)
+
+    async def persist(self, path: str) -> None:
+        """Write the base segment to ``path`` and switch to the mapped copy.
+
+        Later compactions rewrite the same snapshot, so the arrays live in
+        the shared page cache instead of this process's heap.
+        """
+        base = self.base
+        segment = await asyncio.to_thread(save_segment, base, path, self.schema)
+        if self.base is base:
+            self.base = segment
+        self.snapshot_path = path
+        self._snapshot_seen = self._snapshot_version()
+
+    def _snapshot_version(self) -> Optional[Tuple[int, int]]:
+        if not self.snapshot_path:
+            return None
+        try:
+            stat = os.stat(self.snapshot_path)
+        except OSError:
+            return None
+        # Snapshots are renamed into place, so a new one has a new inode.
+        return stat.st_ino, stat.st_mtime_ns
+
+    async def reload(self) -> bool:
+        """Switch to the snapshot if another process has rewritten it.
+
+        Files in the delta buffer that the new snapshot lacks are kept.
+        Returns whether the snapshot was reopened.
+        """
+        version = self._snapshot_version()
+        if version is None or version == self._snapshot_seen or self._compacting:
+            return False
+
+        base = await asyncio.to_thread(load_segment, self.snapshot_path, self.schema)
+        if self._compacting:
+            return False
+
+        delta = (self._delta_ids, self._delta_tokens, self._delta_sizes, self._delta_types)
+        known = np.isin(_ids_array(self._delta_ids), base.ids) if self._delta_ids else []
+        self.base = base
+        self._snapshot_seen = version
+        self._reset_delta()
+        for present, file_id, tokens, size, code in zip(known, *delta):
+            if not present:
+                self.add(file_id, tokens, size, FILE_TYPES[code])
+        return True
+
+    @classmethod
+    async def from_documents(cls, docs, tokenize, schema: int = 0) -> "TitleIndex":
+        """Build an index from an async iterator of raw ``Media`` documents."""
+        vocab: dict = {}
+        doc_len: List[int] = []
+        doc_tokens: List[int] = []
+        sizes: List[int] = []
+        types: List[int] = []
+        ids: List[str] = []
+
+        async for doc in docs:
+            tokens = doc.get("tokens") or tokenize(doc.get("file_name") or "")
+            doc_tokens.extend(vocab.setdefault(t, len(vocab)) for t in tokens)
+            doc_len.append(len(tokens))
+            sizes.append(doc.get("file_size") or 0)
+            types.append(_type_code(doc.get("file_type")))
+            ids.append(doc["_id"])
+
+        def finish() -> Segment:
+            # Token ids were assigned in first-seen order; renumber them so
+            # the vocabulary is sorted and searchable by bisection.
+            first_seen = list(vocab)
+            sorted_vocab = _sorted_vocab(first_seen)
+            remap = np.searchsorted(sorted_vocab, np.array([t.encode() for t in first_seen], dtype=sorted_vocab.dtype))
+            tokens_arr = remap[np.asarray(doc_tokens, dtype=np.int64)] if doc_tokens else []
+            return Segment.build(sorted_vocab, doc_len, tokens_arr, sizes, types, _ids_array(ids))
+
+        return cls(await asyncio.to_thread(finish), schema=schema)
+
+    def add(self, file_id: str, tokens: List[str], file_size: int, file_type: Optional[str]) -> None:
+        idx = len(self)
+        self._delta_ids.append(file_id)
+        self._delta_tokens.append(list(tokens))
+        self._delta_sizes.append(file_size or 0)
+        self._delta_types.append(_type_code(file_type))
+        for token in tokens:
+            self._delta_post.setdefault(token, []).append(idx)
+
+        if len(self._delta_ids) >= COMPACT_THRESHOLD and not self._compacting:
+            asyncio.create_task(self.compact())
+
+    async def compact(self) -> None:
+        """Merge the delta buffer into a new base segment off the event loop."""
+        if self._compacting or not self._delta_ids:
+            return
+
+        self._compacting = True
+        try:
+            merged = len(self._delta_ids)
+            delta = (
+                self._delta_ids[:merged],
+                self._delta_tokens[:merged],
+                self._delta_sizes[:merged],
+                self._delta_types[:merged],
+            )
+            segment = await asyncio.to_thread(self._merge_and_store, self.base, *delta)
+
+            # Files added while merging stay in the delta, renumbered.
+            rest = (
+                self._delta_ids[merged:],
+                self._delta_tokens[merged:],
+                self._delta_sizes[merged:],
+                self._delta_types[merged:],
+            )
+            self.base = segment
+            self._reset_delta()
+            for file_id, tokens, size, code in zip(*rest):
+                self.add(file_id, tokens, size, FILE_TYPES[code])
+        finally:
+            self._compacting = False
+
+    def _merge_and_store(self, base: Segment, *delta) -> Segment:
+        segment = self._merge(base, *delta)
+        if self.snapshot_path:
+            segment = save_segment(segment, self.snapshot_path, self.schema)
+            self._snapshot_seen = self._snapshot_version()
+        return segment
+
+    @staticmethod
+    def _merge(base: Segment, ids, tokens, sizes, types) -> Segment:
+        old_vocab = [t.decode() for t in base.vocab.tolist()]
+        vocab = _sorted_vocab(old_vocab + [t for doc in tokens for t in doc])
+
+        remap = np.searchsorted(vocab, base.vocab.astype(vocab.dtype))
+        new_tokens = np.searchsorted(
+            vocab, np.array([t.encode() for doc in tokens for t in doc], dtype=vocab.dtype)
+        )
+        doc_tokens = np.concatenate([remap[base.doc_tokens], new_tokens]) if len(vocab) else []
+        all_ids = [i.decode() for i in base.ids.tolist()] + list(ids)
+
+        return Segment.build(
+            vocab,
+            np.concatenate([base.doc_lengths(), [len(doc) for doc in tokens]]),
+            doc_tokens,
+            np.concatenate([base.sizes, sizes]),
+            np.concatenate([base.types, types]),
+            _ids_array(all_ids),
+        )
+
+    # ─── Querying ────────────────────────────────────────────────────────
+    def _postings(self, token: str):
+        base = self.base.postings(token)
+        delta = self._delta_post.get(token)
+        if not delta:
+            return base
+        return np.concatenate([base, np.asarray(delta, dtype=np.int32)])
+
+    def _prefix_postings(self, prefix: str):
+        base = self.base.prefix_postings(prefix)
+        delta = [
+            i for token, docs in self._delta_post.items()
+            if token.startswith(prefix) for i in docs
+        ]
+        if not delta:
+            return base
+        return np.union1d(base, np.asarray(delta, dtype=np.int32))
+
+    def _column(self, base_col, delta_col: list, idx):
+        n_base = len(self.base)
+        out = np.empty(len(idx), dtype=base_col.dtype)
+        in_base = idx < n_base
+        out[in_base] = base_col[idx[in_base]]
+        if not in_base.all():
+            out[~in_base] = np.asarray(delta_col, dtype=base_col.dtype)[idx[~in_base] - n_base]
+        return out
+
+    def _doc_lengths(self, idx):
+        return self._column(
+            self.base.doc_lengths(), [len(t) for t in self._delta_tokens], idx
+        )
+
+    def _avg_doc_len(self) -> float:
+        total = len(self.base.doc_tokens) + sum(len(t) for t in self._delta_tokens)
+        return total / max(len(self), 1)
+
+    def _doc_token_strings(self, i: int) -> List[str]:
+        n_base = len(self.base)
+        if i >= n_base:
+            return self._delta_tokens[i - n_base]
+        ids = self.base.doc_tokens[self.base.doc_ptr[i]:self.base.doc_ptr[i + 1]]
+        return [t.decode() for t in self.base.vocab[ids].tolist()]
+
+    def search(
+        self, tokens: List[str], file_type: Optional[str] = None, prefix: Optional[str] = None
+    ):
+        """Return indices of files containing every token, best first.
+
+        With ``prefix`` files must also contain a token starting with it.
+        Every hit holds all the tokens, so files are scored by the BM25
+        length damping alone and the top hits re-ranked with the title
+        boosts; ties go to the most recently indexed file.
+        """
+        postings = [self._postings(t) for t in tokens]
+        if prefix:
+            postings.append(self._prefix_postings(prefix))
+        postings.sort(key=len)
+        if not postings or not len(postings[0]):
+            return np.empty(0, dtype=np.int32)
+
+        result = postings[0]
+        for posting in postings[1:]:
+            result = np.intersect1d(result, posting, assume_unique=True)
+            if not len(result):
+                return result
+
+        if file_type:
+            codes = self._column(self.base.types, self._delta_types, result)
+            result = result[codes == _type_code(file_type)]
+
+        score = ranking.length_norm(self._doc_lengths(result), self._avg_doc_len())
+        order = np.lexsort((-result, -score))
+        result, score = result[order], score[order]
+
+        head = result[:RERANK_DEPTH].tolist()
+        boosted = sorted(
+            range(len(head)),
+            key=lambda k: score[k] * ranking.title_boost(tokens, self._doc_token_strings(head[k])),
+            reverse=True,
+        )
+        result[:len(head)] = [head[k] for k in boosted]
+        return result
+
+    def missing(self, file_ids: List[str]) -> List[str]:
+        """The given ids that are not in the index yet."""
+        if not file_ids:
+            return []
+        known = set(self._delta_ids)
+        wanted = np.array([i.encode() for i in file_ids])
+        present = np.isin(wanted, self.base.ids)
+        return [i for i, hit in zip(file_ids, present.tolist()) if not hit and i not in known]
+
+    def file_ids(self, idx) -> List[str]:
+        n_base = len(self.base)
+        return [
+            self.base.ids[i].decode() if i < n_base else self._delta_ids[i - n_base]
+            for i in idx.tolist()
+        ]
+
+    def page(
+        self,
+        tokens: List[str],
+        file_type: Optional[str],
+        skip: int,
+        limit: int,
+        prefix: Optional[str] = None,
+    ) -> Tuple[List[str], int]:
+        """File ids of one result page plus the total number of matches."""
+        result = self.search(tokens, file_type, prefix)
+        return self.file_ids(result[skip:skip + limit]), len(result)
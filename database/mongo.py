@@ -1,4 +1,11 @@
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo.read_preferences import (
+    Nearest,
+    Primary,
+    PrimaryPreferred,
+    Secondary,
+    SecondaryPreferred,
+)
 from bot.config import settings
 
 _client = None
@@ -11,4 +18,43 @@ def get_db():
         _client = AsyncIOMotorClient(settings.DATABASE_URL)
         _db = _client[settings.DATABASE_NAME]
 
-    return _db
\ No newline at end of file
+    return _db
+
+_media_shards = None
+
+def get_media_shards():
+    """Media collections of the extra databases in ``MEDIA_DATABASE_URLS``."""
+    global _media_shards
+
+    if _media_shards is None:
+        _media_shards = [
+            AsyncIOMotorClient(url)[settings.DATABASE_NAME][settings.COLLECTION_NAME]
+            for url in settings.MEDIA_DATABASE_URLS
+        ]
+
+    return _media_shards
+
+READ_PREFERENCES = {
+    "primary": Primary,
+    "primarypreferred": PrimaryPreferred,
+    "secondary": Secondary,
+    "secondarypreferred": SecondaryPreferred,
+    "nearest": Nearest,
+}
+
+def get_search_read_preference():
+    """Read preference of search queries, from the ``SEARCH_READ_*`` settings.
+
+    Max staleness and hedged reads only apply to modes that may read from
+    secondaries.
+    """
+    mode = READ_PREFERENCES[settings.SEARCH_READ_PREFERENCE.lower()]
+    if mode is Primary:
+        return Primary()
+
+    options = {}
+    if settings.SEARCH_MAX_STALENESS_S:
+        options["max_staleness"] = settings.SEARCH_MAX_STALENESS_S
+    if settings.SEARCH_HEDGED_READS:
+        options["hedge"] = {"enabled": True}
+    return mode(**options)
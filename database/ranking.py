@@ -0,0 +1,65 @@
+"""Relevance ordering for file name search.
+
+Every candidate contains all query tokens and names store each token once,
+so term frequency and IDF weights are the same for all of them; what sets
+matches apart is how much else is in the name. Scores are the BM25 length
+damping of a single occurrence, times title-aware boosts for files whose
+name starts with the query or carries its year.
+"""
+
+import re
+from typing import List, Sequence, Tuple
+
+from database.canonical import YEAR
+
+K1 = 1.2
+B = 0.75
+
+EXACT_TITLE_BOOST = 2.0
+TITLE_PREFIX_BOOST = 1.3
+YEAR_BOOST = 1.2
+
+# Tokens that usually follow the title part of a release name.
+TITLE_END = re.compile(r"(?:19|20)\d{2}|\d{3,4}p|[248]k|s\d{1,2}(?:e\d{1,3})?")
+
+
+def length_norm(doc_len, avgdl: float):
+    """BM25 weight of a single occurrence in a name of ``doc_len`` tokens.
+
+    Works on scalars and NumPy arrays alike.
+    """
+    return (K1 + 1) / (1 + K1 * (1 - B + B * doc_len / max(avgdl, 1e-9)))
+
+
+def title_boost(query: Sequence[str], doc: Sequence[str]) -> float:
+    """Multiplier for names that start with the query, and for year matches."""
+    boost = 1.0
+    n = len(query)
+
+    if list(doc[:n]) == list(query):
+        rest = doc[n:]
+        boost *= EXACT_TITLE_BOOST if not rest or TITLE_END.fullmatch(rest[0]) else TITLE_PREFIX_BOOST
+
+    query_years = {t for t in query if YEAR.fullmatch(t)}
+    if query_years and query_years & {t for t in doc[1:] if YEAR.fullmatch(t)}:
+        boost *= YEAR_BOOST
+
+    return boost
+
+
+def rank(query: List[str], candidates: List[Tuple[str, List[str]]]) -> List[str]:
+    """Order ``(file_id, tokens)`` candidates matching every query token, best first.
+
+    The average name length is taken from the candidates themselves.
+    """
+    if not candidates:
+        return []
+
+    avgdl = sum(len(tokens) for _, tokens in candidates) / len(candidates)
+
+    def score(tokens: List[str]) -> float:
+        return length_norm(len(tokens), avgdl) * title_boost(query, tokens)
+
+    # sorted() is stable, so equal scores keep the candidates' order.
+    ranked = sorted(candidates, key=lambda c: score(c[1]), reverse=True)
+    return [file_id for file_id, _ in ranked]
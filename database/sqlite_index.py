@@ -0,0 +1,137 @@
+"""Local full-text index of file names in SQLite FTS5.
+
+Files are kept in a plain ``files`` table with an external-content FTS5
+table over ``file_name`` maintained by triggers. Matches are ordered by
+FTS5's BM25 ``rank``, newest file first on ties. The index is a single
+file on disk, so small deployments can search without querying Mongo.
+
+All methods are synchronous and serialized by a lock; callers run them
+in a worker thread.
+"""
+
+import os
+import sqlite3
+import threading
+from typing import Iterable, List, Optional
+
+COLUMNS = ("file_id", "file_ref", "file_name", "file_size", "file_type", "mime_type", "caption")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    rowid INTEGER PRIMARY KEY,
+    file_id TEXT NOT NULL UNIQUE,
+    file_ref TEXT,
+    file_name TEXT NOT NULL,
+    file_size INTEGER,
+    file_type TEXT,
+    mime_type TEXT,
+    caption TEXT
+);
+CREATE INDEX IF NOT EXISTS files_file_type ON files(file_type);
+CREATE VIRTUAL TABLE IF NOT EXISTS files_fts USING fts5(
+    file_name,
+    content='files',
+    content_rowid='rowid',
+    tokenize='unicode61 remove_diacritics 2'
+);
+CREATE TRIGGER IF NOT EXISTS files_ai AFTER INSERT ON files BEGIN
+    INSERT INTO files_fts(rowid, file_name) VALUES (new.rowid, new.file_name);
+END;
+CREATE TRIGGER IF NOT EXISTS files_ad AFTER DELETE ON files BEGIN
+    INSERT INTO files_fts(files_fts, rowid, file_name)
+    VALUES ('delete', old.rowid, old.file_name);
+END;
+"""
+
+RESULT_COLUMNS = "f.file_id, f.file_name, f.file_size, f.file_type, f.caption"
+
+
+def match_expression(tokens: List[str], prefix: Optional[str] = None) -> str:
+    """FTS5 query requiring every token, plus a token starting with ``prefix``.
+
+    Tokens are quoted so FTS5 operators typed by users stay plain words.
+    """
+    quote = lambda term: '"' + term.replace('"', '""') + '"'
+    terms = [quote(t) for t in tokens]
+    if prefix:
+        terms.append(quote(prefix) + "*")
+    return " ".join(terms)
+
+
+class SqliteIndex:
+    def __init__(self, path: str):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT count(*) FROM files").fetchone()[0]
+
+    def add_many(self, docs: Iterable[dict]) -> int:
+        """Insert Mongo-shaped documents, skipping known ids. Returns the number added."""
+        rows = [
+            (doc["_id"], *(doc.get(column) for column in COLUMNS[1:]))
+            for doc in docs
+        ]
+        placeholders = ", ".join("?" * len(COLUMNS))
+        with self._lock, self._conn:
+            cursor = self._conn.executemany(
+                f"INSERT OR IGNORE INTO files ({', '.join(COLUMNS)}) VALUES ({placeholders})",
+                rows,
+            )
+            return cursor.rowcount
+
+    def _where(self, match: str, file_type: Optional[str]):
+        clauses, params = [], []
+        if match:
+            clauses.append("files_fts MATCH ?")
+            params.append(match)
+        if file_type:
+            clauses.append("f.file_type = ?")
+            params.append(file_type)
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        source = (
+            "files_fts JOIN files f ON f.rowid = files_fts.rowid" if match else "files f"
+        )
+        return source, where, params
+
+    def search(self, match: str, file_type: Optional[str], skip: int, limit: int) -> List[dict]:
+        """One page of matches, best first; an empty ``match`` lists newest files."""
+        source, where, params = self._where(match, file_type)
+        order = "ORDER BY rank, f.rowid DESC" if match else "ORDER BY f.rowid DESC"
+        sql = f"SELECT {RESULT_COLUMNS} FROM {source} {where} {order} LIMIT ? OFFSET ?"
+        with self._lock:
+            rows = self._conn.execute(sql, (*params, limit, skip)).fetchall()
+        return [{"_id": row["file_id"], **dict(row)} for row in rows]
+
+    def count(self, match: str, file_type: Optional[str], limit: Optional[int] = None) -> int:
+        """Number of matches, stopping at ``limit`` when given."""
+        source, where, params = self._where(match, file_type)
+        inner = f"SELECT 1 FROM {source} {where}"
+        if limit:
+            inner += " LIMIT ?"
+            params.append(limit)
+        with self._lock:
+            return self._conn.execute(f"SELECT count(*) FROM ({inner})", params).fetchone()[0]
+
+    def get(self, file_id: str) -> Optional[dict]:
+        with self._lock:
+            row = self._conn.execute(
+                f"SELECT {', '.join(COLUMNS)} FROM files WHERE file_id = ?", (file_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        doc = {k: row[k] for k in COLUMNS[1:] if row[k] is not None}
+        return {"_id": row["file_id"], **doc}
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
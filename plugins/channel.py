@@ -6,7 +6,7 @@ from bot.utils.broadcast import new_movie_broadcast
 from pyrogram.types import Message
 
 from bot.config import settings
-from database.ia_filterdb import save_file, announce_title
+from database.ia_filterdb import save_file, announce_title, schedule_hot_refresh
 
 
 MEDIA_FILTER = filters.document | filters.video | filters.audio
@@ -32,7 +32,10 @@ async def channel_media_handler(client: Client, message: Message):
 
     media.file_type = file_type
     media.caption = message.caption
+    media.message_date = message.date
 
     saved, reason, title = await save_file(media)
+    if saved:
+        schedule_hot_refresh()
     if saved and await announce_title(title):
         asyncio.create_task(new_movie_broadcast(client, title))
\ No newline at end of file
@@ -21,12 +21,15 @@ from pyrogram.errors.exceptions.bad_request_400 import (
 
 from bot.config import settings
 from bot.utils.cache import RuntimeCache
-from database.ia_filterdb import save_file, announce_title
+from database.ia_filterdb import save_file, announce_title, schedule_hot_refresh
 
 logger = logging.getLogger(__name__)
 
 lock = asyncio.Lock()
 
+# Seconds between hot search page refreshes while an index run saves files.
+HOT_REFRESH_INTERVAL = 300
+
 LINK_REGEX = re.compile(
     r"(https://)?(t\.me/|telegram\.me/|telegram\.dog/)(c/)?(\d+|[\w_]+)/(\d+)$"
 )
@@ -218,6 +221,8 @@ async def index_files_to_db(
     async with lock:
         RuntimeCache.cancel_index = False
         current = RuntimeCache.index_skip
+        loop = asyncio.get_running_loop()
+        next_hot_refresh = loop.time() + HOT_REFRESH_INTERVAL
 
         try:
             async for msg in client.iter_messages(chat_id, last_msg_id, current):
@@ -262,10 +267,14 @@ async def index_files_to_db(
 
                 media.file_type = msg.media.value
                 media.caption = msg.caption
+                media.message_date = msg.date
 
                 saved, reason, title = await save_file(media)
                 if saved:
                     total += 1
+                    if loop.time() >= next_hot_refresh:
+                        schedule_hot_refresh()
+                        next_hot_refresh = loop.time() + HOT_REFRESH_INTERVAL
                     # announce title only once and broadcast to users
                     if await announce_title(title):
                         # schedule broadcast without blocking indexing
@@ -288,4 +297,7 @@ async def index_files_to_db(
                 f"Deleted: <code>{deleted}</code>\n"
                 f"Non-media: <code>{no_media + unsupported}</code>\n"
                 f"Errors: <code>{errors}</code>"
-            )
\ No newline at end of file
+            )
+        finally:
+            if total:
+                schedule_hot_refresh()
\ No newline at end of file
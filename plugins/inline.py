@@ -12,7 +12,7 @@ from pyrogram.errors.exceptions.bad_request_400 import QueryIdInvalid
 from bot.config import settings
 from bot.utils.cache import RuntimeCache
 from bot.utils.helpers import is_subscribed, get_size
-from database.ia_filterdb import get_search_results
+from database.ia_filterdb import format_total, get_search_results
 
 logger = logging.getLogger(__name__)
 
@@ -44,7 +44,7 @@ async def inline_query_handler(client: Client, query: InlineQuery):
 
 
     query_text = query.query.strip()
-    offset = int(query.offset or 0)
+    offset = query.offset or 0
 
     if "|" in query_text:
         keyword, file_type = map(str.strip, query_text.split("|", 1))
@@ -57,12 +57,20 @@ async def inline_query_handler(client: Client, query: InlineQuery):
         [[InlineKeyboardButton("🔍 Search again", switch_inline_query_current_chat=keyword)]]
     )
 
-    files, next_offset, total = await get_search_results(
+    page = await get_search_results(
         keyword,
         file_type=file_type,
         max_results=10,
         offset=offset,
+        with_caption=True,
+        # Inline queries arrive while the user types, so the last word is
+        # usually incomplete unless followed by a space or a type filter.
+        prefix=file_type is None and not query.query.endswith(" "),
+        timeout_ms=settings.INLINE_SEARCH_TIMEOUT_MS,
     )
+    files, next_offset, total = page
+    # Partial answers must not be cached by Telegram.
+    cache_time = 0 if page.partial else INLINE_CACHE_TIME
 
     results = []
 
@@ -95,15 +103,17 @@ async def inline_query_handler(client: Client, query: InlineQuery):
         )
 
     if results:
-        switch_pm_text = f"{emoji.FILE_FOLDER} Results — {total}"
-        if keyword:
+        switch_pm_text = f"{emoji.FILE_FOLDER} Results — {format_total(total)}"
+        if page.partial:
+            switch_pm_text = "⏱ Partial results — refine your query"
+        elif keyword:
             switch_pm_text += f" for {keyword}"
 
         try:
             await query.answer(
                 results=results,
                 is_personal=True,
-                cache_time=INLINE_CACHE_TIME,
+                cache_time=cache_time,
                 next_offset=str(next_offset),
                 switch_pm_text=switch_pm_text,
                 switch_pm_parameter="start",
@@ -114,13 +124,15 @@ async def inline_query_handler(client: Client, query: InlineQuery):
             logger.exception(e)
     else:
         switch_pm_text = f"{emoji.CROSS_MARK} No results"
-        if keyword:
+        if page.partial:
+            switch_pm_text = "⏱ Search timed out — refine your query"
+        elif keyword:
             switch_pm_text += f' for "{keyword}"'
 
         await query.answer(
             results=[],
             is_personal=True,
-            cache_time=INLINE_CACHE_TIME,
+            cache_time=cache_time,
             switch_pm_text=switch_pm_text,
             switch_pm_parameter="okay",
         )
\ No newline at end of file
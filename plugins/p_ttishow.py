@@ -1,3 +1,4 @@
+import html
 import logging
 from pyrogram import Client, filters, enums
 import os
@@ -11,7 +12,7 @@ from pyrogram.errors.exceptions.bad_request_400 import (
 from bot.config import settings
 from database.users_chats_db import db
 from database.connections_mdb import all_connections
-from database.ia_filterdb import Media
+from database.ia_filterdb import count_files, search_cache_stats, slow_query_report
 from bot.utils.cache import RuntimeCache
 from bot.utils.helpers import get_size, get_settings, schedule_delete_message
 from bot.utils.messages import Texts as Text
@@ -211,7 +212,7 @@ async def stats_handler(client: Client, message):
     msg = await message.reply("Fetching stats...")
     users = await db.total_users_count()
     chats = await db.total_chat_count()
-    files = await Media.count_documents()
+    files = await count_files()
     size = await db.get_db_size()
     free = get_size(536870912 - size)
 
@@ -222,6 +223,55 @@ async def stats_handler(client: Client, message):
     )
 
 
+@Client.on_message(filters.command("searchstats") & filters.user(settings.ADMINS))
+async def search_stats_handler(client: Client, message):
+    stats = search_cache_stats()
+    await message.reply(
+        f"<b>🔎 Search Cache</b>\n\n"
+        f"<b>Hits:</b> <code>{stats['cache_hits']}</code>\n"
+        f"<b>Misses:</b> <code>{stats['cache_misses']}</code>\n"
+        f"<b>Hit rate:</b> <code>{stats['hit_rate']:.1%}</code>\n"
+        f"<b>Cached pages:</b> <code>{stats['cached_pages']}</code>\n"
+        f"<b>Coalesced:</b> <code>{stats['coalesced']}</code>\n"
+        f"<b>Bloom rejects:</b> <code>{stats.get('bloom_rejects', 0)}</code>\n"
+        f"<b>Timed out:</b> <code>{stats.get('timeouts', 0)}</code>\n"
+        f"<b>Hot pages:</b> <code>{stats['hot_pages']}</code> "
+        f"(<code>{stats.get('hot_hits', 0)}</code> hits)\n"
+        f"<b>Generation:</b> <code>{stats['generation']}</code>",
+        parse_mode=enums.ParseMode.HTML,
+    )
+
+
+@Client.on_message(filters.command("slowqueries") & filters.user(settings.ADMINS))
+async def slow_queries_handler(client: Client, message):
+    if not settings.SLOW_QUERY_MS:
+        return await message.reply("Set SLOW_QUERY_MS to profile slow searches.")
+
+    entries = slow_query_report()
+    if not entries:
+        return await message.reply(f"No searches slower than {settings.SLOW_QUERY_MS} ms yet.")
+
+    lines = [f"<b>🐢 Searches over {settings.SLOW_QUERY_MS} ms</b>\n"]
+    for entry in entries:
+        flag = "⚠️ " if entry.needs_index else ""
+        lines.append(
+            f"{flag}<b>{entry.count}×</b> avg <code>{entry.total_ms / entry.count:.0f} ms</code>, "
+            f"max <code>{entry.max_ms:.0f} ms</code>\n"
+            f"<code>{html.escape(entry.shape)}</code>\n"
+            f"Plan: <code>{html.escape(entry.plan or 'pending')}</code>"
+        )
+        if entry.docs_examined is not None:
+            lines[-1] += (
+                f"\nExamined <code>{entry.keys_examined}</code> keys, "
+                f"<code>{entry.docs_examined}</code> docs for "
+                f"<code>{entry.returned}</code> rows"
+            )
+    # Drop the least costly shapes until the report fits in one message.
+    while len("\n\n".join(lines)) > 4000 and len(lines) > 2:
+        lines.pop()
+    await message.reply("\n\n".join(lines), parse_mode=enums.ParseMode.HTML)
+
+
 @Client.on_message(filters.command("logs") & filters.user(settings.ADMINS))
 async def logs_handler(client: Client, message):
     """Send recent error log contents to admins.
@@ -1,7 +1,7 @@
 import asyncio
 import re
 import ast
-import math
+import hashlib
 import logging
 
 from pyrogram import Client, filters, enums
@@ -26,11 +26,16 @@ from database.connections_mdb import (
 from database.users_chats_db import db
 from database.ia_filterdb import (
     Media,
+    format_total,
     get_file_details,
+    get_faceted_results,
+    get_group_versions,
     get_search_results,
+    rejected_by_bloom,
 )
+from database.canonical import canonical_query
 from database.filters_mdb import del_all, find_filter, get_filters
-from bot.utils.cache import RuntimeCache
+from bot.utils.cache import RuntimeCache, TTLCache
 from bot.utils.helpers import (
     get_size,
     is_subscribed,
@@ -39,13 +44,40 @@ from bot.utils.helpers import (
     get_file_id,
 )
 from bot.services.web_search import search_gagala
+from bot.utils.messages import Texts
 
 from bot.services.imdb_service import get_poster
 
 logger = logging.getLogger(__name__)
 
-BUTTONS: dict[str, str] = {}
+# Per-message search state below is kept as long as result messages are
+# (6 hours), for at most this many messages.
+STATE_TTL = 6 * 60 * 60
+STATE_SIZE = 10_000
+
+# Search per result message key ("<chat id>-<message id>").
+BUTTONS = TTLCache(maxsize=STATE_SIZE, ttl=STATE_TTL)
+# Page tokens per BUTTONS key: index N holds the offset of page N. Tokens
+# are kept here because Telegram limits callback data to 64 bytes.
+PAGE_TOKENS = TTLCache(maxsize=STATE_SIZE, ttl=STATE_TTL)
+# Search mode per BUTTONS key when results came from a fallback mode.
+SEARCH_MODES = TTLCache(maxsize=STATE_SIZE, ttl=STATE_TTL)
+# Group keys of grouped results by short digest, for callback data.
+GROUP_KEYS = TTLCache(maxsize=STATE_SIZE, ttl=STATE_TTL)
+# BUTTONS keys whose pages are grouped by title.
+GROUPED = TTLCache(maxsize=STATE_SIZE, ttl=STATE_TTL)
+# Facet counts shown under each page, file type filters, and the search
+# and file type from before the first facet was tapped, per BUTTONS key.
+FACETS = TTLCache(maxsize=STATE_SIZE, ttl=STATE_TTL)
+FILE_TYPES = TTLCache(maxsize=STATE_SIZE, ttl=STATE_TTL)
+FACET_BASE = TTLCache(maxsize=STATE_SIZE, ttl=STATE_TTL)
+# Most frequent values offered per facet.
+FACET_ROW_SIZE = 4
 SPELL_CHECK: dict[int, list[str]] = {}
+# Pages fetched ahead of a NEXT click, by (BUTTONS key, page), each with
+# the search it was fetched for.
+PREFETCHED = TTLCache(maxsize=1024, ttl=settings.PREFETCH_TTL)
+_prefetch_tasks: set[asyncio.Task] = set()
 
 
 # ---------------- GROUP MESSAGE HANDLER ---------------- #
@@ -194,31 +226,54 @@ async def set_startup_image(client: Client, message):
 
 @Client.on_callback_query(filters.regex(r"^next_"))
 async def next_page(client: Client, query: CallbackQuery):
-    _, req, key, offset = query.data.split("_")
+    _, req, key, page = query.data.split("_")
 
     if int(req) not in {query.from_user.id, 0}:
         return await query.answer("Not authorized", show_alert=True)
 
-    offset = int(offset) if offset.isdigit() else 0
+    page = int(page) if page.isdigit() else 0
     search = BUTTONS.get(key)
+    tokens = PAGE_TOKENS.get(key)
 
-    if not search:
+    if not search or not tokens or page >= len(tokens):
         return await query.answer("Old message expired", show_alert=True)
 
-    files, next_offset, total = await get_search_results(
-        search, offset=offset, filter=True
-    )
+    result = prefetched_page(key, page)
+    if result is None:
+        result = await fetch_page(key, page)
+    files, next_offset, total = result
+    hint = Texts.PARTIAL_RESULTS_TXT if result.partial else None
 
     if not files:
-        return await query.answer()
+        return await query.answer(hint)
 
-    settings_data = await get_settings(query.message.chat.id)
+    if next_offset and len(tokens) == page + 1:
+        tokens.append(next_offset)
+
+    markup = await page_markup(query.message.chat.id, req, key, page, result)
+
+    try:
+        await query.edit_message_reply_markup(markup)
+    except MessageNotModified:
+        pass
+
+    await query.answer(hint)
+    if next_offset:
+        prefetch_page(key, page + 1)
+
+
+async def page_markup(chat_id: int, req, key: str, page: int, result) -> InlineKeyboardMarkup:
+    """Result buttons, facet filters and navigation for one page."""
+    files, next_offset, total = result
+    settings_data = await get_settings(chat_id)
     secure = settings_data["file_secure"]
     pre = "filep" if secure else "file"
 
     buttons = []
     for file in files:
-        if settings_data["button"]:
+        if getattr(file, "count", 1) > 1:
+            buttons.append([group_button(file, req, key)])
+        elif settings_data["button"]:
             buttons.append([
                 InlineKeyboardButton(
                     f"[{get_size(file.file_size)}] {file.file_name}",
@@ -231,34 +286,220 @@ async def next_page(client: Client, query: CallbackQuery):
                 InlineKeyboardButton(get_size(file.file_size), callback_data=f"{pre}#{file.file_id}"),
             ])
 
-    page = math.ceil(offset / 10) + 1
-    total_pages = math.ceil(total / 10)
+    buttons.extend(facet_buttons(req, key))
+    total_pages = format_total(total, 10)
 
     nav = []
-    if offset > 0:
+    if page > 0:
         nav.append(
-            InlineKeyboardButton("⏪ BACK", callback_data=f"next_{req}_{key}_{offset-10}")
+            InlineKeyboardButton("⏪ BACK", callback_data=f"next_{req}_{key}_{page-1}")
         )
     nav.append(
-        InlineKeyboardButton(f"📃 {page}/{total_pages}", callback_data="pages")
+        InlineKeyboardButton(f"📃 {page + 1}/{total_pages}", callback_data="pages")
     )
     if next_offset:
         nav.append(
-            InlineKeyboardButton("NEXT ⏩", callback_data=f"next_{req}_{key}_{next_offset}")
+            InlineKeyboardButton("NEXT ⏩", callback_data=f"next_{req}_{key}_{page+1}")
         )
 
     buttons.append(nav)
+    return InlineKeyboardMarkup(buttons)
+
+
+def page_search(key: str, page: int) -> tuple:
+    """Search, file type, offset, mode and grouping of page ``page`` of ``key``."""
+    return (
+        BUTTONS.get(key),
+        FILE_TYPES.get(key),
+        PAGE_TOKENS.get(key)[page],
+        SEARCH_MODES.get(key),
+        key in GROUPED,
+    )
+
+
+async def fetch_page(key: str, page: int, search: tuple | None = None):
+    """Search page ``page`` of the results registered under ``key``."""
+    query, file_type, offset, mode, group = search or page_search(key, page)
+    return await get_search_results(
+        query, file_type, offset=offset, filter=True, mode=mode, group=group
+    )
+
+
+def prefetched_page(key: str, page: int):
+    """The prefetched ``page`` of ``key``, if it is still the page shown.
+
+    A facet filter can change the search while a prefetch of the old one
+    is running; its page is then ignored.
+    """
+    entry = PREFETCHED.get((key, page))
+    if entry is None:
+        return None
+    search, result = entry
+    return result if search == page_search(key, page) else None
+
 
+def prefetch_page(key: str, page: int) -> None:
+    """Fetch ``page`` in the background so its NEXT click is served from memory.
+
+    Prefetched pages outlive the search result cache, which is cleared
+    whenever a file is indexed, and expire after ``PREFETCH_TTL`` seconds.
+    """
+    if not settings.PREFETCH_TTL or prefetched_page(key, page) is not None:
+        return
+    task = asyncio.create_task(_prefetch(key, page))
+    _prefetch_tasks.add(task)
+    task.add_done_callback(_prefetch_tasks.discard)
+
+
+async def _prefetch(key: str, page: int) -> None:
     try:
-        await query.edit_message_reply_markup(
-            InlineKeyboardMarkup(buttons)
-        )
+        search = page_search(key, page)
+        result = await fetch_page(key, page, search)
+    except Exception:
+        logger.exception("Prefetching page %s of %s failed", page, key)
+        return
+    # Partial pages are searched again on click, like uncached ones.
+    if result[0] and not result.partial:
+        PREFETCHED.set((key, page), (search, result))
+
+
+def button_owner(message) -> int:
+    """User allowed to press the result buttons of ``message``.
+
+    Anonymous admins post without a user; 0 lets anyone use the buttons.
+    """
+    return message.from_user.id if message.from_user else 0
+
+
+def group_button(group, req, key: str) -> InlineKeyboardButton:
+    """Button that expands a grouped title into its versions."""
+    digest = hashlib.blake2b(group.key.encode(), digest_size=6).hexdigest()
+    GROUP_KEYS.set(digest, group.key)
+    return InlineKeyboardButton(
+        f"[{group.count} files] {group.file_name}",
+        callback_data=f"grp#{req}#{digest}#{key}",
+    )
+
+
+@Client.on_callback_query(filters.regex(r"^grp#"))
+async def group_versions(client: Client, query: CallbackQuery):
+    _, req, digest, key = query.data.split("#")
+
+    if int(req) not in {query.from_user.id, 0}:
+        return await query.answer("Not authorized", show_alert=True)
+
+    group_key = GROUP_KEYS.get(digest)
+    if not group_key or key not in PAGE_TOKENS:
+        return await query.answer("Old message expired", show_alert=True)
+
+    # Only the versions the search asked for: its file type and tag words.
+    files = await get_group_versions(group_key, FILE_TYPES.get(key), BUTTONS.get(key))
+    if not files:
+        return await query.answer("File not found", show_alert=True)
+
+    settings_data = await get_settings(query.message.chat.id)
+    pre = "filep" if settings_data["file_secure"] else "file"
+
+    buttons = [
+        [
+            InlineKeyboardButton(
+                f"[{get_size(file.file_size)}] {file.file_name}",
+                callback_data=f"{pre}#{file.file_id}",
+            )
+        ]
+        for file in files
+    ]
+    buttons.append([
+        InlineKeyboardButton("⏪ BACK", callback_data=f"next_{req}_{key}_0")
+    ])
+
+    try:
+        await query.edit_message_reply_markup(InlineKeyboardMarkup(buttons))
     except MessageNotModified:
         pass
 
     await query.answer()
 
 
+def facet_buttons(req, key: str, facets: dict | None = None, capped: bool = False) -> list:
+    """Filter rows for the facets of a search that have several values.
+
+    ``facets`` defaults to the counts stored for ``key``; ``capped`` counts
+    are lower bounds and shown as "N+".
+    """
+    if facets is None:
+        facets, capped = FACETS.get(key) or ({}, False)
+    plus = "+" if capped else ""
+    rows = []
+    for field, values in facets.items():
+        if len(values) < 2:
+            continue
+        rows.append([
+            InlineKeyboardButton(
+                f"{str(value).title()} ({count}{plus})",
+                callback_data=f"fct#{req}#{key}#{field}#{value}",
+            )
+            for value, count in values[:FACET_ROW_SIZE]
+        ])
+    if key in FACET_BASE:
+        rows.append([
+            InlineKeyboardButton("✖ All results", callback_data=f"fct#{req}#{key}#reset#")
+        ])
+    return rows
+
+
+@Client.on_callback_query(filters.regex(r"^fct#"))
+async def facet_filter(client: Client, query: CallbackQuery):
+    _, req, key, field, value = query.data.split("#")
+
+    if int(req) not in {query.from_user.id, 0}:
+        return await query.answer("Not authorized", show_alert=True)
+
+    search = BUTTONS.get(key)
+    if not search:
+        return await query.answer("Old message expired", show_alert=True)
+
+    file_type = FILE_TYPES.get(key)
+    if field == "reset":
+        search, file_type = FACET_BASE.get(key, (search, file_type))
+    elif field == "file_type":
+        file_type = value
+    else:
+        # Quality and year words in a query become tag filters.
+        search = f"{search} {value}"
+
+    result = await get_faceted_results(search, file_type)
+    files, next_offset, _ = result
+    hint = Texts.PARTIAL_RESULTS_TXT if result.partial else None
+    if not files:
+        return await query.answer(hint or "No results", show_alert=not hint)
+
+    if field == "reset":
+        FACET_BASE.pop(key, None)
+    else:
+        if key not in FACET_BASE:
+            FACET_BASE.set(key, (BUTTONS.get(key), FILE_TYPES.get(key)))
+    for page in range(len(PAGE_TOKENS.get(key, ()))):
+        PREFETCHED.pop((key, page))
+    BUTTONS.set(key, search)
+    PAGE_TOKENS.set(key, [0, next_offset] if next_offset else [0])
+    FACETS.set(key, (result.facets or {}, result.facets_capped))
+    if file_type:
+        FILE_TYPES.set(key, file_type)
+    else:
+        FILE_TYPES.pop(key, None)
+
+    markup = await page_markup(query.message.chat.id, req, key, 0, result)
+    try:
+        await query.edit_message_reply_markup(markup)
+    except MessageNotModified:
+        pass
+
+    await query.answer(hint)
+    if next_offset:
+        prefetch_page(key, 1)
+
+
 # ---------------- CALLBACK HANDLER ---------------- #
 
 @Client.on_callback_query()
@@ -318,19 +559,55 @@ async def auto_filter(client: Client, message, spoll=None):
         if message.text.startswith("/") or len(message.text) > 100:
             return
         search = message.text.strip()
-        files, offset, total = await get_search_results(search.lower(), filter=True)
+        mode = None
+        group = settings.GROUP_RESULTS
+        if settings.SEARCH_FACETS and not group:
+            result = await get_faceted_results(search)
+        else:
+            result = await get_search_results(search, filter=True, group=group)
+        if (
+            not result[0]
+            and not result.partial
+            and settings.SEARCH_TRIGRAM_FALLBACK
+            and settings.SEARCH_MODE != "trigram"
+            and not rejected_by_bloom(search)
+        ):
+            # near misses and typos: rank by shared trigrams before spell check
+            mode = "trigram"
+            group = False
+            result = await get_search_results(search, filter=True, mode=mode)
+        files, offset, total = result
+        partial = result.partial
+        facets = result.facets
+        facets_capped = result.facets_capped
         if not files:
+            if partial:
+                # group chatter that timed out is not worth a reply
+                if message.chat.type == enums.ChatType.PRIVATE:
+                    await message.reply(Texts.PARTIAL_RESULTS_TXT)
+                return
             if settings_data["spell_check"]:
                 return await spell_check(message)
             return
     else:
         search, files, offset, total = spoll
+        mode = None
+        group = False
+        partial = False
+        facets = None
+        facets_capped = False
         message = message.message.reply_to_message
 
     pre = "filep" if settings_data["file_secure"] else "file"
+    key = f"{message.chat.id}-{message.id}"
+    req = button_owner(message)
+    facet_rows = facet_buttons(req, key, facets, facets_capped) if facets else []
     buttons = []
 
     for file in files:
+        if getattr(file, "count", 1) > 1:
+            buttons.append([group_button(file, req, key)])
+            continue
         buttons.append([
             InlineKeyboardButton(
                 f"[{get_size(file.file_size)}] {file.file_name}",
@@ -338,14 +615,25 @@ async def auto_filter(client: Client, message, spoll=None):
             )
         ])
 
+    if offset or group or facet_rows:
+        # Grouped rows and facet filters link back to page 0, so keep the
+        # search around.
+        BUTTONS.set(key, search)
+        PAGE_TOKENS.set(key, [0, offset] if offset else [0])
+        if mode:
+            SEARCH_MODES.set(key, mode)
+        if group:
+            GROUPED.set(key, True)
+        if facet_rows:
+            FACETS.set(key, (facets, facets_capped))
+            buttons.extend(facet_rows)
+
     if offset:
-        key = f"{message.chat.id}-{message.id}"
-        BUTTONS[key] = search
         buttons.append([
             InlineKeyboardButton("🗓 1", callback_data="pages"),
             InlineKeyboardButton(
                 "NEXT ⏩",
-                callback_data=f"next_{message.from_user.id}_{key}_{offset}",
+                callback_data=f"next_{req}_{key}_1",
             ),
         ])
 
@@ -356,6 +644,8 @@ async def auto_filter(client: Client, message, spoll=None):
         if imdb
         else f"Results for <b>{search}</b>\n\n<i>(Note: Files will be automatically deleted after 6hrs)</i>"
     )
+    if partial:
+        caption += f"\n\n{Texts.PARTIAL_RESULTS_TXT}"
 
     if imdb and imdb.get("poster"):
         try:
@@ -382,11 +672,14 @@ async def auto_filter(client: Client, message, spoll=None):
         else:
             await message.reply_text(caption, reply_markup=InlineKeyboardMarkup(buttons))
 
+    if offset:
+        prefetch_page(key, 1)
+
 
 # ---------------- SPELL CHECK ---------------- #
 
 async def spell_check(message):
-    query = re.sub(r"\b(movie|file|send|pls|please)\b", "", message.text, flags=re.I)
+    query = canonical_query(message.text)
     results = await search_gagala(query)
 
     if not results:
@@ -396,7 +689,7 @@ async def spell_check(message):
     SPELL_CHECK[message.id] = results[:3]
 
     buttons = [
-        [InlineKeyboardButton(title, callback_data=f"spolling#{message.from_user.id}#{i}")]
+        [InlineKeyboardButton(title, callback_data=f"spolling#{button_owner(message)}#{i}")]
         for i, title in enumerate(results[:3])
     ]
     buttons.append([InlineKeyboardButton("Close", callback_data="close_data")])